@@ -1,15 +1,59 @@
 #!venv/bin/python
 
+import argparse
+import json
 import logging
+import cache
+import faults
+import latency
+import memdiag
+import profiling
+import recorder
+import remote
+import tracing
 from controller import main
 from config import LOGLEVEL
 from tools import UrwidHandler
-import sys
 
-if len(sys.argv) > 1:
-    logfile = logging.FileHandler("client%s.log" % sys.argv[1], mode="w")
-else:
-    logfile = logging.FileHandler("client.log", mode="w")
+parser = argparse.ArgumentParser(description="Webgames terminal client")
+parser.add_argument("instance", nargs="?", default="",
+                    help="suffix of the log and session files, to run several clients")
+parser.add_argument("--standalone", action="store_true",
+                    help="do not attach to the session daemon (daemon.py) even if running")
+parser.add_argument("--record", metavar="FILE",
+                    help="append every msgqueue frame to FILE, see replay.py")
+parser.add_argument("--trace", metavar="FILE",
+                    help="write a Chrome trace of the session to FILE on exit")
+parser.add_argument("--profile", metavar="PREFIX",
+                    help="profile the session, write PREFIX.pstats, PREFIX.collapsed "
+                         "(flamegraph stacks) and PREFIX.coroutines on exit, "
+                         "F9 toggles profiling at runtime")
+parser.add_argument("--memory", metavar="SECONDS", type=int, nargs="?", const=300,
+                    help="trace allocations and log the top growing sites every "
+                         "SECONDS (default 300)")
+parser.add_argument("--faults", metavar="JSON", type=json.loads,
+                    help="inject network faults, see faults.Faults for the settings")
+parser.add_argument("--latency", metavar="FILE",
+                    help="append the matchmaking waits and a summary of the event "
+                         "latencies every minute to FILE, as JSON lines")
+args = parser.parse_args()
+
+cache.setup(args.instance)
+remote.setup(args.instance)
+if args.standalone:
+    remote.path = None
+if args.record:
+    recorder.start(args.record)
+if args.trace:
+    tracing.start(args.trace)
+if args.profile:
+    profiling.start(args.profile)
+if args.memory:
+    memdiag.start(args.memory)
+if args.latency:
+    latency.start(args.latency)
+
+logfile = logging.FileHandler("client%s.log" % args.instance, mode="w")
 logfile.formatter = logging.Formatter(
     "{asctime} [{levelname}] <{name}:{funcName}> {message}", style="{")
 logfile.level = LOGLEVEL
@@ -21,4 +65,5 @@ urwidhdl.level = logging.INFO
 logging.root.handlers = [logfile, urwidhdl]
 logging.root.level = LOGLEVEL
 
+faults.configure(args.faults)
 main()
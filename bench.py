@@ -0,0 +1,284 @@
+#!venv/bin/python
+"""
+Benchmarks against the local stand-in server (mockserver.py).
+
+    faults       API latency, failures and event delivery under degraded
+                 networks (see faults.Faults)
+    compression  bytes on the wire and decoding CPU per event of the
+                 msgqueue streams for every encoding (see compression.py)
+    batch        group creation flow with a request per call, batched and
+                 batched against a server without the batch endpoint
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import time
+import uuid
+
+import urwid
+
+import cache
+import compression
+import controller
+import dialog
+import events
+import faults
+import metrics
+import model
+import remote
+import supervisor
+import view
+from mockserver import MockServer
+from tools import decode_token
+
+PROFILES = {
+    "clean": None,
+    "slow": {"latency": ["lognormal", 4.5, 0.6], "seed": 1},
+    "narrow": {"latency": ["fixed", 20], "bandwidth": 8192, "fragment": 16, "seed": 1},
+    "lossy": {"latency": ["uniform", 10, 100], "reset": 0.05, "http_5xx": 0.05, "seed": 1},
+}
+
+
+async def setup():
+    # The bench session must neither replace the cached one nor reach a daemon
+    cache.path = cache.players_path = None
+    remote.path = None
+    server = MockServer()
+    model.APIURL = await server.serve()
+    view.main_loop = urwid.MainLoop(
+        view.interface,
+        palette=dialog.DialogDisplay.palette,
+        event_loop=urwid.AsyncioEventLoop(loop=controller.loop))
+    model.container.token = await model.connect("bench", "bench")
+    controller.update_user_from_token(decode_token(model.container.token))
+    await model.create_group(1)
+    controller.update_group(await model.get_my_group())
+    return server
+
+async def lag_monitor(histogram, interval=0.01):
+    while True:
+        before = time.perf_counter()
+        await asyncio.sleep(interval)
+        histogram.observe((time.perf_counter() - before - interval) * 1000)
+
+async def bench_faults(server, profile, calls, storm):
+    faults.configure(profile)
+    api = metrics.Histogram("api ms")
+    lag = metrics.Histogram("loop lag ms", metrics.FINE_BOUNDS)
+    latency = metrics.Histogram("event ms")
+    failures = 0
+
+    started = time.perf_counter()
+    for _ in range(calls):
+        before = time.perf_counter()
+        try:
+            await model.get_my_group()
+        except Exception:
+            failures += 1
+        api.observe((time.perf_counter() - before) * 1000)
+    api_time = time.perf_counter() - started
+
+    handlers = model.event_handlers["group"]["group"]
+    originals = {cmd: handlers[cmd] for cmd in ("user is ready", "user is not ready")}
+    received = 0
+    def timed(handler):
+        def wrapped(payload):
+            nonlocal received
+            handler(payload)
+            latency.observe((time.time() - payload["sent"]) * 1000)
+            received += 1
+        return wrapped
+    handlers.update({cmd: timed(handler) for cmd, handler in originals.items()})
+
+    queue = events.get_queue("group")
+    collapsed = queue.collapsed
+    # The stream of the previous profile may not be closed yet
+    streams = server.streams[(model.container.user.userid, "group")]
+    previous = set(streams)
+    supervisor.group.spawn(model.msgqueue("group"), "msgqueue")
+    monitor = asyncio.ensure_future(lag_monitor(lag))
+    while not streams - previous:
+        await asyncio.sleep(0.01)
+    started = time.perf_counter()
+    server.storm(model.container.group.groupid, storm)
+    while received + queue.collapsed - collapsed < storm and time.perf_counter() - started < 60:
+        await asyncio.sleep(0.01)
+    storm_time = time.perf_counter() - started
+
+    monitor.cancel()
+    supervisor.group.cancel()
+    handlers.update(originals)
+    injected = faults.active.stats if faults.active is not None else {}
+    faults.configure(None)
+    return {
+        "api p50 ms": round(api.percentile(50), 1),
+        "api p95 ms": round(api.percentile(95), 1),
+        "api failures": failures, "api total s": round(api_time, 2),
+        "events": received, "collapsed": queue.collapsed - collapsed,
+        "storm s": round(storm_time, 2),
+        "event p50 ms": round(latency.percentile(50), 1),
+        "event p95 ms": round(latency.percentile(95), 1),
+        "loop lag p95 ms": round(lag.percentile(95), 1), "loop lag max ms": round(lag.max, 1),
+        "injected": dict(injected)}
+
+class Tape:
+    """Msgqueue response keeping the chunks it reads, to replay them"""
+    def __init__(self, headers, stream=None, chunks=()):
+        self.headers = headers
+        self.content = self
+        self.stream = stream
+        self.chunks = list(chunks)
+        self.replayed = iter(self.chunks)
+
+    async def readany(self):
+        if self.stream is None:
+            return next(self.replayed, b"")
+        chunk = await self.stream.readany()
+        self.chunks.append(chunk)
+        return chunk
+
+async def bench_compression(server, encodings, storm, rounds):
+    model.STREAM_ENCODINGS = encodings
+    received = 0
+    streams = server.streams[(model.container.user.userid, "group")]
+    previous = set(streams)
+    async with model.open_stream("group") as res:
+        tape = Tape(res.headers, res.content)
+        while not streams - previous:
+            await asyncio.sleep(0.01)
+        server.storm(model.container.group.groupid, storm)
+        async for message in model.reader(tape, "group"):
+            received += 1
+            if received == storm:
+                break
+
+    wire = sum(map(len, tape.chunks))
+    started = time.process_time()
+    for _ in range(rounds):
+        async for message in model.reader(Tape(tape.headers, chunks=tape.chunks), "group"):
+            pass
+    cpu = time.process_time() - started
+
+    # The decompression alone
+    encoding = tape.headers.get(compression.HEADER)
+    started = time.process_time()
+    if encoding is not None:
+        for _ in range(rounds):
+            decoder = compression.decompressor(encoding)
+            for chunk in tape.chunks:
+                decoder.decompress(chunk)
+    inflate = time.process_time() - started
+    return {"events": received, "chunks": len(tape.chunks),
+            "wire B/event": round(wire / received, 1),
+            "reader us/event": round(cpu / rounds / received * 1e6, 2),
+            "inflate us/event": round(inflate / rounds / received * 1e6, 2)}
+
+async def run_compression(args):
+    server = await setup()
+    # Some more members for realistic payloads, they never read their events
+    group = server.groups[model.container.group.groupid]
+    for number in range(3):
+        group["members"].append({"id": str(uuid.uuid4()), "name": "player%d" % number, "ready": False})
+
+    results = {}
+    for name in ("none", "gzip", "deflate", "deflate-dict"):
+        results[name] = await bench_compression(
+            server, [] if name == "none" else [name], args.storm, args.rounds)
+    baseline = results["none"]["wire B/event"]
+    for row in results.values():
+        row["ratio"] = round(row["wire B/event"] / baseline, 2)
+    print_table(results)
+
+async def one_by_one(gameid):
+    groupid = await model.create_group(gameid)
+    return groupid, await model.get_my_group()
+
+async def bench_batch(server, profile, flow, rounds):
+    faults.configure(profile)
+    flows = metrics.Histogram("flow ms")
+    failures = 0
+    started = time.perf_counter()
+    for gameid in range(1, rounds + 1):
+        before = time.perf_counter()
+        try:
+            await flow(gameid)
+        except Exception:
+            failures += 1
+        flows.observe((time.perf_counter() - before) * 1000)
+    total = time.perf_counter() - started
+    faults.configure(None)
+    return {"p50 ms": round(flows.percentile(50), 1), "p95 ms": round(flows.percentile(95), 1),
+            "mean ms": round(flows.total / rounds, 1), "failures": failures,
+            "total s": round(total, 2)}
+
+async def run_batch(args):
+    server = await setup()
+    flows = {
+        "single": one_by_one,
+        "batched": lambda gameid: model.batch(
+            model.create_group(gameid), model.get_my_group()),
+    }
+    profiles = {"custom": args.profile} if args.profile else {
+        name: PROFILES[name] for name in ("clean", "slow")}
+    results = {}
+    for profile_name, profile in profiles.items():
+        for flow_name, flow in flows.items():
+            results["%s %s" % (flow_name, profile_name)] = await bench_batch(
+                server, profile, flow, args.rounds)
+        server.batching = False
+        results["fallback %s" % profile_name] = await bench_batch(
+            server, profile, flows["batched"], args.rounds)
+        server.batching = model.batch_supported = True
+    print_table(results)
+
+def print_table(results):
+    columns = list(next(iter(results.values())))
+    width = max(10, max(map(len, results)) + 2)
+    widths = [max(16, len(column) + 2) for column in columns]
+    print(" " * width + "".join(column.rjust(size) for column, size in zip(columns, widths)))
+    for name, row in results.items():
+        print(name.ljust(width) + "".join(
+            str(row[column]).rjust(size) for column, size in zip(columns, widths)))
+
+async def run_faults(args):
+    server = await setup()
+    profiles = {"custom": args.profile} if args.profile else PROFILES
+    results = {}
+    for name, profile in profiles.items():
+        results[name] = await bench_faults(server, profile, args.calls, args.storm)
+    print_table(results)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command")
+    parser_faults = commands.add_parser("faults")
+    parser_faults.add_argument("--calls", type=int, default=50)
+    parser_faults.add_argument("--storm", type=int, default=1000, help="events in the storm")
+    parser_faults.add_argument("--profile", type=json.loads, metavar="JSON",
+                               help="faults.Faults settings, instead of the builtin profiles")
+    parser_compression = commands.add_parser("compression")
+    parser_compression.add_argument("--storm", type=int, default=1000, help="events in the storm")
+    parser_compression.add_argument("--rounds", type=int, default=20,
+                                    help="times the recieved chunks are decoded again")
+    parser_batch = commands.add_parser("batch")
+    parser_batch.add_argument("--rounds", type=int, default=50, help="groups created per flow")
+    parser_batch.add_argument("--profile", type=json.loads, metavar="JSON",
+                              help="faults.Faults settings, instead of the clean and slow profiles")
+    args = parser.parse_args()
+
+    logging.root.handlers = [logging.NullHandler()]
+    if args.command == "faults":
+        controller.loop.run_until_complete(run_faults(args))
+    elif args.command == "compression":
+        controller.loop.run_until_complete(run_compression(args))
+    elif args.command == "batch":
+        controller.loop.run_until_complete(run_batch(args))
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+import json
+import os
+from contextlib import suppress
+from logging import getLogger
+
+from config import SESSION_CACHE, PLAYERS_CACHE
+
+logger = getLogger(__name__)
+
+path = SESSION_CACHE.format("") if SESSION_CACHE else None
+players_path = PLAYERS_CACHE.format("") if PLAYERS_CACHE else None
+
+def setup(instance):
+    global path, players_path
+    if SESSION_CACHE:
+        path = SESSION_CACHE.format(instance)
+    if PLAYERS_CACHE:
+        players_path = PLAYERS_CACHE.format(instance)
+
+def read(path):
+    if path is None:
+        return None
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as exc:
+        logger.warning("Cannot read cache %s: %s", path, exc)
+        return None
+
+def write(path, obj):
+    if path is None:
+        return
+    try:
+        os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+        tmppath = path + ".tmp"
+        fd = os.open(tmppath, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as file:
+            json.dump(obj, file)
+        os.replace(tmppath, path)
+    except OSError as exc:
+        logger.warning("Cannot write cache %s: %s", path, exc)
+
+def load():
+    return read(path)
+
+def save(session):
+    write(path, session)
+
+def load_players():
+    return read(players_path) or []
+
+def save_players(names):
+    write(players_path, names)
+
+def clear():
+    if path is None:
+        return
+    with suppress(FileNotFoundError):
+        os.remove(path)
@@ -0,0 +1,72 @@
+"""
+Compression of the msgqueue event streams.
+
+The encoding is negotiated with the X-Msgqueue-Encoding headers instead of
+Content-Encoding so aiohttp hands the compressed chunks over as they come,
+model.reader inflates them incrementally. The server flushes the deflate
+stream after every frame so events are never held back.
+"""
+
+import zlib
+
+HEADER = "X-Msgqueue-Encoding"
+
+# Preset dictionary shared with the server, made of the recurring parts of
+# the events so even the first frames of a stream compress well. Its
+# checksum is part of the encoding name, a server with another dictionary
+# simply does not pick it.
+DICTIONARY = b"".join([
+    b'{"type": "heartbeat"}\x1e',
+    b'{"type": "server:notice", "notice": "',
+    b'{"type": "game:over"}\x1e',
+    b'{"type": "game:started", "host": "", "ports": [',
+    b'{"type": "game:starting"}\x1e',
+    b'{"type": "group:queue joined"}\x1e',
+    b'{"type": "group:invitation recieved", "from": {"userid": "',
+    b'"}, "to": {"groupid": "", "gamename": "',
+    b'{"type": "group:user joined", "user": {"userid": "',
+    b'{"type": "group:user left", "user": {"userid": "',
+    b'{"type": "group:user is not ready", "user": {"userid": "',
+    b'{"type": "group:user is ready", "user": {"userid": "',
+    b'", "username": "',
+    b'"}, "sent": ',
+])
+DICTIONARY_ENCODING = "deflate-dict-%08x" % zlib.adler32(DICTIONARY)
+
+ENCODINGS = {
+    DICTIONARY_ENCODING: (zlib.MAX_WBITS, DICTIONARY),
+    "deflate": (zlib.MAX_WBITS, None),
+    "gzip": (16 + zlib.MAX_WBITS, None),
+}
+
+
+def accept(names):
+    """Value of the request header for the given encodings, by preference"""
+    return ", ".join(DICTIONARY_ENCODING if name == "deflate-dict" else name
+                     for name in names)
+
+def negotiate(header):
+    """Encoding picked by the server for the request header, None for none"""
+    for name in (header or "").split(","):
+        if name.strip() in ENCODINGS:
+            return name.strip()
+    return None
+
+def compressor(encoding, level=6):
+    wbits, zdict = ENCODINGS[encoding]
+    if zdict is None:
+        return zlib.compressobj(level, zlib.DEFLATED, wbits)
+    return zlib.compressobj(level, zlib.DEFLATED, wbits, zdict=zdict)
+
+def encode(compressor, frame):
+    """Compress a whole frame, readable as soon as it is recieved"""
+    return compressor.compress(frame) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+def decompressor(encoding):
+    """Incremental decoder for the response header, None when not compressed"""
+    if encoding is None:
+        return None
+    wbits, zdict = ENCODINGS[encoding]
+    if zdict is None:
+        return zlib.decompressobj(wbits)
+    return zlib.decompressobj(wbits, zdict=zdict)
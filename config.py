@@ -1,8 +1,41 @@
 from logging import DEBUG
+from os.path import expanduser
 
 APIURL = "http://localhost:22548"
 LOGLEVEL = DEBUG
 
+# Set to None to disable the on-disk session cache, "{}" is the instance name
+SESSION_CACHE = expanduser("~/.cache/webgames/session{}.json")
+# Player names known for the invite autocompletion, None to not keep them
+PLAYERS_CACHE = expanduser("~/.cache/webgames/players{}.json")
+# Unix socket of the session daemon (daemon.py), None to never attach
+DAEMON_SOCKET = expanduser("~/.cache/webgames/daemon{}.sock")
+TOKEN_REFRESH_MARGIN = 120
+
+# Seconds before a user action (click, form submission) is abandoned
+ACTION_TIMEOUT = 60
+
+# Event handlers running at once per msgqueue scope, 1 keeps them ordered
+HANDLER_LIMITS = {"user": 4, "group": 1, "party": 1}
+
+# (max size, overflow policy) of the event queue of each msgqueue scope,
+# the policy is one of "block", "drop" or "collapse", see events.EventQueue
+EVENT_QUEUES = {"user": (64, "drop"), "group": (64, "collapse"), "party": (64, "collapse")}
+
+# Compressions offered for the msgqueue streams, by preference, among
+# "deflate-dict" (preset dictionary, see compression.py), "deflate" and "gzip"
+STREAM_ENCODINGS = ["deflate-dict", "deflate"]
+
+# Optional endpoint listing every player name for the invite autocompletion
+PLAYER_DIRECTORY = None
+INVITE_CONCURRENCY = 4
+
+# Game endpoints are probed before launching the game, within this many
+# seconds, the results are appended to PROBE_LOG (None to disable)
+PROBE_BUDGET = 0.5
+PROBE_UDP = False
+PROBE_LOG = "probes.jsonl"
+
 GAMES = {
     1: ["gnome-terminal", "-e", "/home/julien/Projets/Webgames/Shifumi/client.py --addr {host} --port {port}"]
 }
@@ -3,10 +3,10 @@ import aiohttp
 import logging
 import atexit
 import urwid
+import os
+import time
 import json
 from itertools import chain
-from base64 import urlsafe_b64decode
-from functools import wraps
 from subprocess import Popen
 
 loop = asyncio.get_event_loop()
@@ -15,40 +15,52 @@ loop.set_debug(True)
 import view
 import model
 import dialog
-from config import GAMES
-from tools import tryexcept, async_tryexcept, find
+import widgets
+import cache
+import latency
+import metrics
+import probe
+import profiling
+import recorder
+import remote
+import scheduler
+import supervisor
+import tracing
+from config import GAMES, TOKEN_REFRESH_MARGIN, PLAYER_DIRECTORY, INVITE_CONCURRENCY
+from scheduler import action
+from tools import tryexcept, async_tryexcept, find, decode_token, APIError
 import webapi.storage.models
 
 logger = logging.getLogger(__name__)
-tasks = {}
-
-interface_locked = False
-def onlyone(func):
-    @wraps(func)
-    async def wrapped(*args, **kwargs):
-        global interface_locked
-        if interface_locked:
-            logger.info("Interface locked !")
-            return
-        interface_locked = True
-        logger.info("Interface locked.")
-        try:
-            value = await func(*args, **kwargs)
-        except:
-            interface_locked = False
-            raise
-        finally:
-            interface_locked = False
-        logger.info("Interface unlocked.")
-        return value
-    return wrapped
+game = None
+# Readiness asked by the latest click on Ready, until it is sent
+ready_target = None
+ready_clicks = 0
+# Number of player names in the players cache
+saved_players = 0
+# Alarm polling the log file while the logs screen is shown
+logs_alarm = None
 
 def main():
     register_events()
     view.main_loop = urwid.MainLoop(
         view.interface,
         palette=dialog.DialogDisplay.palette,
+        unhandled_input=on_unhandled_input,
         event_loop=urwid.AsyncioEventLoop(loop=loop))
+    hook_draw_screen()
+    attached = (remote.path is not None and os.path.exists(remote.path)
+                and loop.run_until_complete(remote.remote.attach(remote.path)))
+    model.prefetch_game_list()
+    session = cache.load()
+    if attached:
+        # The daemon session prevails over the cached one
+        token = loop.run_until_complete(remote.remote.call("session"))["token"]
+        if token is None:
+            session = None
+        elif session is None or session["token"] != token:
+            session = {"token": token, "group": None, "game": None}
+    resume_session(session)
     try:
         view.main_loop.run()
     except KeyboardInterrupt:
@@ -59,43 +71,81 @@ def main():
         logger.exception("Unhandled error in main loop")
 
 
+def hook_draw_screen():
+    """Measure the screen draws, for the latencies and the trace"""
+    view.main_loop.draw_screen = latency.rendering(view.main_loop.draw_screen)
+    if tracing.enabled:
+        view.main_loop.draw_screen = tracing.traced("render", root=True)(view.main_loop.draw_screen)
+
 @atexit.register
 def exit_():
     if model.container.token:
-        asyncio.get_event_loop().run_until_complete(model.disconnect())
-    for task in tasks.values():
-        task.cancel()
+        if cache.path is None and not remote.remote.connected:
+            asyncio.get_event_loop().run_until_complete(model.disconnect())
+        else:
+            save_session()
+    # The daemon keeps the session and subscriptions for the next client
+    remote.remote.detach()
+    supervisor.user.cancel()
     loop.run_until_complete(model.http.close())
     loop.close()
 
+def on_unhandled_input(key):
+    if key == "f2":
+        show_stats()
+    elif key == "f9":
+        profiling.toggle()
+
+def show_stats():
+    lines = []
+    def add(name, stats):
+        if isinstance(stats, dict):
+            stats = ", ".join("%s: %s" % (k, round(v, 1)) for k, v in stats.items())
+        lines.append("%s: %s" % (name, stats))
+
+    for name, stats in sorted(metrics.snapshot().items()):
+        add(name, stats)
+    for name, stats in supervisor.stats().items():
+        add("task group %s" % name, stats)
+    for name, stats in sorted(scheduler.stats().items()):
+        add("actions %s" % name, stats)
+    logger.debug("Stats:\n%s", "\n".join(lines))
+    dialog.linesbox("Stats", lines, 0, 0)
+
 def form_handler(form, handler):
     def handler_call(_):
         fields = [field[0].edit_text for field in form.contents[:-2]]
-        asyncio.ensure_future(handler(*fields))
+        asyncio.ensure_future(tracing.root("submit %s" % handler.__name__, handler(*fields)))
     return handler_call
 
 def button_handler(handler):
     def handler_call(button, *args):
-        asyncio.ensure_future(handler(*args))
+        asyncio.ensure_future(tracing.root("click %s" % handler.__name__, handler(*args)))
     return handler_call
 
 def register_events():
     urwid.connect_signal(view.b_quit, "click", on_quit_clicked)
     urwid.connect_signal(view.sb_login, "click", form_handler(view.f_login, on_login_submited))
     urwid.connect_signal(view.b_new_group, "click", button_handler(on_new_group_clicked))
+    urwid.connect_signal(view.p_new_group, "select", button_handler(on_game_selected))
     urwid.connect_signal(view.b_group, "click", on_group_clicked)
     urwid.connect_signal(view.b_invite, "click", on_invite_clicked)
     urwid.connect_signal(view.b_leave, "click", button_handler(on_leave_clicked))
     urwid.connect_signal(view.b_ready, "click", button_handler(on_ready_clicked))
     urwid.connect_signal(view.b_start, "click", button_handler(on_start_clicked))
     urwid.connect_signal(view.b_home, "click", button_handler(on_tmp_clicked))
+    urwid.connect_signal(view.b_logs, "click", on_logs_clicked)
+    urwid.connect_signal(view.b_home, "click", on_home_clicked)
+    urwid.connect_signal(view.b_logout, "click", button_handler(on_logout_clicked))
 
 async def on_tmp_clicked():
-    dialog.do_inputbox("Player name to invite", 8, 30).call(lambda *args: logger.info(args))
+    dialog.inputbox("Player name to invite", 8, 30, lambda *args: logger.info(args))
 
 
 
 def change_navbar_to(navbar):
+    if view.body.contents[0][0] is navbar:
+        return
     view.body.contents[0] = (navbar, view.body.options())
     view.body.focus_position = 0
 
@@ -103,8 +153,28 @@ def change_screen_to(screen):
     view.body.contents[1] = (screen, view.body.options())
     view.body.focus_position = 0
 
+def current_screen():
+    screen = view.body.contents[1][0]
+    return find(lambda name: view.screens[name] is screen, view.screens)
+
+def show_state_screen(in_group, screen=None):
+    """Show screen, or keep the current one, unless it does not fit the group state"""
+    if in_group:
+        change_navbar_to(view.n_in_group)
+        valid, default = ("in group", "in queue", "playing"), view.s_in_group
+    else:
+        change_navbar_to(view.n_connected)
+        valid, default = ("connected home", "new group"), view.s_connected_home
+    if screen in valid:
+        change_screen_to(view.screens[screen])
+    elif current_screen() not in valid + ("logs",):
+        change_screen_to(default)
+
 def on_home_clicked(_button):
-    change_screen_to(view.s_connected_home)
+    if model.container.token is None:
+        change_screen_to(view.s_not_connected_home)
+    else:
+        change_screen_to(view.s_connected_home)
 
 def on_quit_clicked(_button):
     raise urwid.ExitMainLoop()
@@ -112,160 +182,336 @@ def on_quit_clicked(_button):
 def on_group_clicked(_button):
     change_screen_to(view.s_in_group)
 
+def on_logs_clicked(_button):
+    if view.s_logs is None:
+        handler = find(lambda hdl: isinstance(hdl, logging.FileHandler), logging.root.handlers)
+        if handler is None:
+            logger.warning("No log file to browse.")
+            return
+        view.s_logs = urwid.LineBox(widgets.LogBrowser(handler.baseFilename), "Logs")
+        view.screens["logs"] = view.s_logs
+    change_screen_to(view.s_logs)
+    if logs_alarm is None:
+        poll_logs()
+
+def poll_logs(*_):
+    global logs_alarm
+    logs_alarm = None
+    if view.body.contents[1][0] is not view.s_logs:
+        return
+    # the file is indexed a chunk per call, between the other events
+    indexing = view.s_logs.original_widget.poll()
+    logs_alarm = view.main_loop.set_alarm_in(0 if indexing else 1, poll_logs)
+
 
 def on_invite_clicked(_button):
-    async def callback(exitcode, player):
+    def callback(exitcode, players):
         if exitcode != 0:
             return
-        asyncio.ensure_future(async_tryexcept(onlyone(model.invite))(player))
-        view.footer.set_text("%s has been invited." % player)
-    
-    dialog.do_inputbox("Player name to invite", 8, 30).call(
-        lambda *args: asyncio.ensure_future(callback(*args)))
+        names = [name.strip() for name in players.split(",") if name.strip()]
+        asyncio.ensure_future(invite(names))
+
+    dialog.completion("Players to invite, comma separated", 14, 40,
+                      lambda word: model.players.search(word, 5), callback)
+
+@async_tryexcept
+@action("invite")
+async def invite(names):
+    semaphore = asyncio.Semaphore(INVITE_CONCURRENCY)
+    async def invite_one(name):
+        async with semaphore:
+            await model.invite(name)
+        model.remember_players([name])
+
+    results = await asyncio.gather(*map(invite_one, names), return_exceptions=True)
+    succeeded = [name for name, result in zip(names, results) if result is None]
+    if succeeded:
+        logger.info("%s invited.", ", ".join(succeeded))
+    if len(succeeded) < len(names):
+        logger.error("Could not invite %s, see logs for details.", ", ".join(
+            name for name, result in zip(names, results) if result is not None))
 
 @async_tryexcept
-@onlyone
+@action("session", timeout=None)
 async def on_login_submited(login, password):
+    started = time.monotonic()
     model.container.token = await model.connect(login, password)
-    b64payload = model.container.token.split(".")[1]
-    payload = json.loads(urlsafe_b64decode(b64payload + "=" * (len(b64payload) % 4)).decode())
+    model.container.credentials = (login, password)
+    update_user_from_token(decode_token(model.container.token))
+    await start_session(started)
 
-    update_user_from_token(payload)
+async def start_session(started):
+    # Everything that only needs the token is started at once
+    supervisor.user.spawn(model.msgqueue("user"), "msgqueue")
+    model.prefetch_game_list()
 
     group = await model.get_my_group()
     if group is None:
-        change_navbar_to(view.n_connected)
-        change_screen_to(view.s_connected_home)
+        supervisor.group.cancel()
+        model.container.group = model.Container()
+        model.container.game = None
+        show_state_screen(False)
     else:
         update_group(group)
-        game = await model.get_game_by_id(group["gameid"])
-        view.t_game_name.set_text("Game: %s" % game["name"])
+        if supervisor.group.get("msgqueue") is None:
+            supervisor.group.spawn(model.msgqueue("group"), "msgqueue")
+        update_game(await model.get_game_by_id(group["gameid"]))
+        show_state_screen(True)
+    view.t_stale.set_text("")
+
+    if PLAYER_DIRECTORY is not None:
+        supervisor.user.spawn(load_player_directory(), "directory")
+    save_session()
+    supervisor.user.spawn(refresh_token(), "refresh")
+    logger.info("Ready in %d ms.", (time.monotonic() - started) * 1000)
+
+def resume_session(session):
+    global saved_players
+    started = time.monotonic()
+    if session is None:
+        return
+
+    payload = decode_token(session["token"])
+    if "exp" in payload and payload["exp"] - TOKEN_REFRESH_MARGIN < time.time():
+        logger.info("Cached session expired, please sign in.")
+        cache.clear()
+        return
+
+    # Render the last known state right away, reconcile it afterward
+    model.container.token = session["token"]
+    update_user_from_token(payload)
+    model.remember_players(cache.load_players())
+    saved_players = len(model.players)
+    if session["group"] is not None:
+        update_group(session["group"])
+        if session["game"] is not None:
+            update_game(session["game"])
+    show_state_screen(session["group"] is not None, session.get("screen"))
+    view.t_stale.set_text("Last known state, synchronizing...")
+    logger.info("Session restored, synchronizing...")
+    asyncio.ensure_future(reconcile_session(started))
 
-        # Player should be able to join its old game
-        raise NotImplementedError("")
-    
-    urwid.connect_signal(view.b_home, "click", on_home_clicked)
-    tasks["user"] = asyncio.ensure_future(model.msgqueue("user"))
+@async_tryexcept
+@action("session", timeout=None)
+async def reconcile_session(started):
+    try:
+        await start_session(started)
+    except APIError as exc:
+        if exc.args[0] not in (401, 403):
+            raise
+        end_session("Cached session is no more valid, please sign in.")
+
+@async_tryexcept
+@action("session", timeout=None)
+async def on_logout_clicked():
+    await model.disconnect()
+    end_session("Logged out.")
+
+def end_session(message):
+    """Forget the session and its cache, back to the login screen"""
+    logger.info(message)
+    supervisor.user.cancel()
+    model.container.token = None
+    model.container.credentials = None
+    model.container.user = model.Container()
+    model.container.group = model.Container()
+    model.container.game = None
+    cache.clear()
+    view.t_stale.set_text("")
+    change_navbar_to(view.n_not_connected)
+    change_screen_to(view.s_not_connected_home)
+
+def save_session():
+    if model.container.token is None:
+        return
+    cache.save({
+        "token": model.container.token,
+        "user": vars(model.container.user),
+        "group": vars(model.container.group) or None,
+        "game": model.container.game,
+        "screen": current_screen()})
+    save_players()
+
+def save_players():
+    # The names are only ever added to, they changed when there are more
+    global saved_players
+    if len(model.players) != saved_players:
+        cache.save_players(model.players.items)
+        saved_players = len(model.players)
+
+@async_tryexcept
+async def load_player_directory():
+    model.remember_players(await model.get_player_directory())
+    logger.debug("%d player names known.", len(model.players))
+
+@async_tryexcept
+async def refresh_token():
+    while True:
+        payload = decode_token(model.container.token)
+        if "exp" not in payload:
+            return
+        await asyncio.sleep(max(0, payload["exp"] - TOKEN_REFRESH_MARGIN - time.time()))
+        if model.container.credentials is None:
+            # Resumed from the cache, the password was never known
+            logger.warning("Session is about to expire, please sign in again.")
+            await asyncio.sleep(max(0, payload["exp"] - time.time()))
+            end_session("Session expired, please sign in.")
+            return
+        model.container.token = await model.connect(*model.container.credentials)
+        save_session()
+        logger.debug("Token refreshed.")
 
 def update_user_from_token(token_dict):
     model.container.user.userid = token_dict["uid"]
     model.container.user.type = token_dict["typ"]
     model.container.user.nick = token_dict["nic"]
 
-    view.t_connected_as.set_text("Connected as %s" % model.container.user.nick)
-    view.t_user_id.set_text("User id: %s" % model.container.user.userid)
-    view.t_user_type.set_text("User type: %s" % model.container.user.type)
+    set_text(view.t_connected_as, "Connected as %s" % model.container.user.nick)
+    set_text(view.t_user_id, "User id: %s" % model.container.user.userid)
+    set_text(view.t_user_type, "User type: %s" % model.container.user.type)
 
 def update_group(group):
+    if recorder.recording is not None:
+        recorder.record("snapshot", json.dumps(group).encode())
     model.container.group.state = group["state"]
     model.container.group.members = group["members"]
     model.container.group.groupid = group["groupid"]
     model.container.group.gameid = group["gameid"]
     model.container.group.slotid = group["slotid"]
     model.container.group.partyid = group["partyid"]
+    model.remember_players(member["name"] for member in group["members"])
     render_group()
+    save_session()
+
+def update_game(game):
+    model.container.game = game
+    set_text(view.t_game_name, "Game: %s" % game["name"])
+
+# Group member rows by member id, updated in place by render_group
+member_rows = {}
+
+def set_text(text, markup):
+    if text.text != markup:
+        text.set_text(markup)
 
 def render_group():
-    view.t_group_state.set_text("Group status %s" % model.container.group.state)
-    view.p_members.contents = [
-        (urwid.Columns([urwid.Text(member["name"]),
-                        urwid.Text("ready" if member["ready"] else "not ready", align="right")]),
-         view.p_members.options()) for member in model.container.group.members]
+    set_text(view.t_group_state, "Group status %s" % model.container.group.state)
+
+    rows = []
+    for member in model.container.group.members:
+        ready = "ready" if member["ready"] else "not ready"
+        if member["id"] not in member_rows:
+            member_rows[member["id"]] = urwid.Columns([
+                urwid.Text(member["name"]), urwid.Text(ready, align="right")])
+        else:
+            name_text, ready_text = (widget for widget, _ in member_rows[member["id"]].contents)
+            set_text(name_text, member["name"])
+            set_text(ready_text, ready)
+        rows.append(member_rows[member["id"]])
+
+    for memberid in member_rows.keys() - {member["id"] for member in model.container.group.members}:
+        del member_rows[memberid]
+    if [widget for widget, _ in view.p_members.contents] != rows:
+        view.p_members.contents = [(row, view.p_members.options()) for row in rows]
 
 @async_tryexcept
-@onlyone
+@action("catalog")
 async def on_new_group_clicked():
-    games = await model.get_game_list()
-
-    choices = []
-    for game in games:
-        button = urwid.Button(game["name"])
-        urwid.connect_signal(button, "click", button_handler(on_game_selected), game["gameid"])
-        choices.append(urwid.AttrMap(button, None, focus_map="reversed"))
-
-    view.f_new_group.clear()
-    view.f_new_group.extend(choices)
+    view.p_new_group.set_catalog(await model.get_game_list())
     change_screen_to(view.s_new_group)
 
 @async_tryexcept
-@onlyone
-async def on_game_selected(gameid):
-    model.groupid = await model.create_group(gameid)
-    group = await model.get_my_group()
+@action("group")
+async def on_game_selected(game):
+    model.groupid, group = await model.batch(
+        model.create_group(game["gameid"]), model.get_my_group())
     update_group(group)
+    update_game(game)
 
-    game = await model.get_game_by_id(gameid)
-    view.t_game_name.set_text("Game name: %s" % game["name"])
-
-    tasks["group"] = asyncio.ensure_future(model.msgqueue("group"))
+    supervisor.group.spawn(model.msgqueue("group"), "msgqueue")
 
     change_navbar_to(view.n_in_group)
     change_screen_to(view.s_in_group)
 
 @async_tryexcept
-@onlyone
+@action("group")
 async def on_leave_clicked():
     await model.leave_group()
 
     logger.info("Group left.")
-    tasks["group"].cancel()
+    supervisor.group.cancel()
+    latency.reset()
+    model.container.group = model.Container()
+    model.container.game = None
+    save_session()
 
     change_navbar_to(view.n_connected)
     change_screen_to(view.s_connected_home)
 
-@async_tryexcept
-@onlyone
 async def on_ready_clicked():
-    if find(lambda member: member["id"] == model.container.user.userid,
-            model.container.group.members)["ready"]:
-        await model.mark_as_not_ready()
-    else:
+    global ready_target, ready_clicks
+    # Toggle what the previous click asked for, the server may not know it yet
+    if ready_target is None:
+        me = find(lambda member: member["id"] == model.container.user.userid,
+                  model.container.group.members)
+        ready_target = me["ready"]
+    ready_target = not ready_target
+    ready_clicks += 1
+    click = ready_clicks
+    try:
+        await set_readiness(ready_target)
+    finally:
+        if click == ready_clicks:
+            ready_target = None
+
+@async_tryexcept
+@action("group", latest_wins=True)
+async def set_readiness(ready):
+    if ready:
         await model.mark_as_ready()
+    else:
+        await model.mark_as_not_ready()
 
 @async_tryexcept
-@onlyone
+@action("group")
 async def on_start_clicked():
     await model.start()
 
 @model.event_handler("user", "group", "invitation recieved")
 def invited(payload):
+    model.remember_players([payload["from"]["username"]])
+
     @async_tryexcept
-    @onlyone
+    @action("group")
     async def callback(exitcode, _):
         if exitcode != 0:
             return
 
-        await model.join_group(payload["to"]["groupid"])
-        tasks["group"] = asyncio.ensure_future(model.msgqueue("group"))
-
-        group = await model.get_my_group()
+        _, group = await model.batch(
+            model.join_group(payload["to"]["groupid"]), model.get_my_group())
+        supervisor.group.spawn(model.msgqueue("group"), "msgqueue")
         update_group(group)
 
-        view.t_game_name.set_text("Game name: %s" % payload["to"]["gamename"])
+        update_game({"gameid": group["gameid"], "name": payload["to"]["gamename"]})
 
         change_navbar_to(view.n_in_group)
         change_screen_to(view.s_in_group)
 
-    dialog.do_yesno(
+    dialog.yesno(
         "You have been invited by {} to join a game of {}. "
         "Would you like to join the group ?".format(
             payload["from"]["username"], payload["to"]["gamename"]),
-        8, 40).call(lambda *args: asyncio.ensure_future(callback(*args)))
+        8, 40, lambda *args: asyncio.ensure_future(callback(*args)))
 
 @model.event_handler("group", "group", "user joined")
 def group_user_joined(payload):
+    model.remember_players([payload["user"]["username"]])
     model.container.group.members.append({
         "id": payload["user"]["userid"],
         "name": payload["user"]["username"],
         "ready": False
     })
-
-    view.p_members.contents.append((
-        urwid.Columns([
-            urwid.Text(payload["user"]["username"]),
-            urwid.Text("not ready", align="right")]),
-        view.p_members.options()))
-    
+    render_group()
     logger.info("%s joined the group.", payload["user"]["username"])
 
 @model.event_handler("group", "group", "user left")
@@ -301,8 +547,9 @@ def group_queue_joined(payload):
         update_group(group)
 
     logger.info("Matchmaking...")
+    latency.step("queue joined", payload)
     change_screen_to(view.s_in_queue)
-    asyncio.ensure_future(coro())
+    supervisor.group.spawn(coro())
 
 @model.event_handler("group", "game", "starting")
 def group_game_is_starting(payload):
@@ -311,38 +558,48 @@ def group_game_is_starting(payload):
         update_group(group)
 
     logger.info("Match found !")
+    latency.step("game starting", payload)
     change_screen_to(view.s_playing)
-    tasks["party"] = asyncio.ensure_future(model.msgqueue("party"))
-    asyncio.ensure_future(coro())
+    supervisor.party.spawn(model.msgqueue("party"), "msgqueue")
+    supervisor.group.spawn(coro())
 
 @model.event_handler("party", "game", "started")
-def party_game_started(payload):
-    logger.info("Game started on %s:%d", payload["host"], payload["ports"][0])
+async def party_game_started(payload):
     global game
+    latency.step("game started", payload)
+    port, results = await probe.probe(payload["host"], payload["ports"])
+    probe.record(payload["host"], port, results,
+                 partyid=model.container.group.partyid, gameid=model.container.group.gameid)
+    logger.info("Game started on %s:%d", payload["host"], port)
 
     args = GAMES[model.container.group.gameid]
-    args = map(lambda arg: arg.format(host=payload["host"], port=payload["ports"][0]), args)
+    args = map(lambda arg: arg.format(host=payload["host"], port=port), args)
     try:
         game = Popen(list(args))
     except Exception as exc:
         logger.exception("%s, see logs for details.", str(exc))
 
 @model.event_handler("party", "game", "over")
-def party_game_started(payload):
+def party_game_over(payload):
+    global game
     async def coro():
         group = await model.get_my_group()
         update_group(group)
 
-    tasks["party"].cancel()
-    if game.poll() is None:
-        logger.info("Terminating the game...")
-        game.terminate()
-    game.wait()
+    # Also cancels the launch if the probe is still running
+    supervisor.party.cancel()
+    latency.reset()
+    if game is not None:
+        if game.poll() is None:
+            logger.info("Terminating the game...")
+            game.terminate()
+        game.wait()
+        game = None
 
     logger.info("Game is over, sent back to group")
     change_navbar_to(view.n_in_group)
     change_screen_to(view.s_in_group)
-    asyncio.ensure_future(coro())
+    supervisor.group.spawn(coro())
 
 @model.event_handler("user", "server", "notice")
 def user_server_notice(payload):
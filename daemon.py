@@ -0,0 +1,140 @@
+#!venv/bin/python
+"""
+Session daemon, owns the authenticated HTTP session and the msgqueue
+streams so terminal clients and scripts can attach and detach without
+logging in again or losing their subscriptions.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+from collections import defaultdict
+from contextlib import suppress
+
+import tenacity
+
+import controller  # creates the event loop used by model
+import model
+import remote
+from config import LOGLEVEL
+from tools import APIError
+
+logger = logging.getLogger(__name__)
+
+API = {"register", "connect", "disconnect", "fetch_game_list", "create_group",
+       "get_my_group", "get_game_by_id", "invite", "join_group", "mark_as_ready",
+       "mark_as_not_ready", "leave_group", "start", "get_player_directory"}
+
+subscribers = defaultdict(set)
+streams = {}
+
+
+def send(writer, packet):
+    writer.write(json.dumps(packet).encode() + b"\n")
+
+@model.stream_retry()
+async def stream(scope):
+    with suppress(asyncio.CancelledError):
+        async with model.open_stream(scope) as res:
+            logger.info("Getting messages from scope %s", scope)
+            async for message in model.reader(res, scope):
+                if message["type"] == "heartbeat":
+                    continue
+                # Nobody attached, the client will fetch the state again
+                for writer in subscribers[scope]:
+                    send(writer, {"event": scope, "message": message})
+            logger.info("End of stream for scope %s", scope)
+            raise tenacity.TryAgain()
+
+def close_stream(scope):
+    task = streams.pop(scope, None)
+    if task is not None:
+        task.cancel()
+
+async def call(writer, packet):
+    name = packet["call"]
+    try:
+        if name == "session":
+            result = {"token": model.container.token}
+        elif name in API:
+            result = await getattr(model, name)(*packet["args"])
+        else:
+            raise APIError(400, "Unknown call %s" % name)
+    except APIError as exc:
+        send(writer, {"id": packet["id"], "error": list(exc.args)})
+        return
+    except Exception as exc:
+        logger.exception("Call %s failed", name)
+        send(writer, {"id": packet["id"], "error": [500, str(exc)]})
+        return
+
+    if name == "connect":
+        model.container.token = result
+    elif name == "disconnect":
+        model.container.token = None
+        for scope in list(streams):
+            close_stream(scope)
+    send(writer, {"id": packet["id"], "result": result})
+
+async def handle(reader, writer):
+    logger.info("Client attached.")
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            packet = json.loads(line)
+            if "call" in packet:
+                asyncio.ensure_future(call(writer, packet))
+            elif "subscribe" in packet:
+                scope = packet["subscribe"]
+                subscribers[scope].add(writer)
+                if scope not in streams or streams[scope].done():
+                    streams[scope] = asyncio.ensure_future(stream(scope))
+            elif "unsubscribe" in packet:
+                # The scope was left, not merely detached from
+                scope = packet["unsubscribe"]
+                subscribers[scope].discard(writer)
+                if not subscribers[scope]:
+                    close_stream(scope)
+    finally:
+        # Streams stay open for the next client to attach
+        for writers in subscribers.values():
+            writers.discard(writer)
+        writer.close()
+        logger.info("Client detached.")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("instance", nargs="?", default="",
+                        help="suffix of the socket, to run several daemons")
+    args = parser.parse_args()
+    remote.setup(args.instance)
+
+    logfile = logging.FileHandler("daemon%s.log" % args.instance)
+    logfile.formatter = logging.Formatter(
+        "{asctime} [{levelname}] <{name}:{funcName}> {message}", style="{")
+    logging.root.handlers = [logfile]
+    logging.root.level = LOGLEVEL
+
+    loop = asyncio.get_event_loop()
+    os.makedirs(os.path.dirname(remote.path), mode=0o700, exist_ok=True)
+    with suppress(FileNotFoundError):
+        os.remove(remote.path)
+    server = loop.run_until_complete(asyncio.start_unix_server(handle, remote.path))
+    os.chmod(remote.path, 0o600)
+    logger.info("Listening on %s", remote.path)
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        with suppress(FileNotFoundError):
+            os.remove(remote.path)
+
+
+if __name__ == "__main__":
+    main()
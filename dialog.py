@@ -26,9 +26,17 @@ Urwid example similar to dialog(1) program
 
 import asyncio
 import sys
+from collections import deque
 
 import urwid
 import view
+from widgets import FileWalker
+
+def size(value):
+    value = int(value)
+    if value <= 0:
+        return ('relative', 80)
+    return value
 
 class DialogExit(Exception):
     pass
@@ -47,12 +55,8 @@ class DialogDisplay:
         ]
 
     def __init__(self, text, height, width, body=None):
-        width = int(width)
-        if width <= 0:
-            width = ('relative', 80)
-        height = int(height)
-        if height <= 0:
-            height = ('relative', 80)
+        self.width = size(width)
+        self.height = size(height)
 
         self.body = body
         if body is None:
@@ -61,7 +65,8 @@ class DialogDisplay:
 
         self.frame = urwid.Frame( body, focus_part='footer')
         if text is not None:
-            self.frame.header = urwid.Pile( [urwid.Text(text),
+            self.text = urwid.Text(text)
+            self.frame.header = urwid.Pile( [self.text,
                 urwid.Divider()] )
         w = self.frame
 
@@ -76,14 +81,23 @@ class DialogDisplay:
             ,'shadow'))])
         w = urwid.Frame( w, footer =
             urwid.AttrWrap(urwid.Text(('border','  ')),'shadow'))
+        # what the dialog manager lays over the interface
+        self.box = w
 
         # outermost border area
-        w = urwid.Padding(w, 'center', width )
-        w = urwid.Filler(w, 'middle', height )
+        w = urwid.Padding(w, 'center', self.width )
+        w = urwid.Filler(w, 'middle', self.height )
         w = urwid.AttrWrap( w, 'border' )
 
         self.view = w
 
+    def retarget(self, text, height, width):
+        """Reuse the dialog for another call"""
+        self.text.set_text(text)
+        self.width = size(width)
+        self.height = size(height)
+        self.frame.set_focus('footer')
+        self.buttons.set_focus(0)
 
     def add_buttons(self, buttons):
         l = []
@@ -99,6 +113,9 @@ class DialogDisplay:
     def button_press(self, button):
         self.fuck(button)
 
+    def unhandled_key(self, size, k):
+        pass
+
     def main(self):
         self.loop = urwid.MainLoop(self.view, self.palette, unhandled_input=lambda key: self.unhandled_key((0,0), key))
         try:
@@ -107,22 +124,7 @@ class DialogDisplay:
             return self.on_exit( e.args[0] )
     
     def call(self, callback):
-        def rollback(exitcode, exitstr):
-            view.main_loop.widget = view.interface
-            view.main_loop.palette = ()
-            view.main_loop.unhandled_input = lambda key: None
-            callback(exitcode, exitstr)
-        view.main_loop.widget = self.view
-        view.main_loop.unhandled_input = lambda key: self.unhandled_key((0,0), key)
-
-        def func(button):
-            if type(button) is int:
-                rollback(*self.on_exit(button))
-            else:
-                rollback(*self.on_exit(button.exitcode))
-
-        self.button_press = func
-        self.fuck = func
+        manager.push(self, (), callback)
 
     def on_exit(self, exitcode):
         return exitcode, ""
@@ -139,6 +141,11 @@ class InputDialogDisplay(DialogDisplay):
 
         self.frame.set_focus('body')
 
+    def retarget(self, text, height, width):
+        DialogDisplay.retarget(self, text, height, width)
+        self.edit.set_edit_text("")
+        self.frame.set_focus('body')
+
     def unhandled_key(self, size, k):
         if k in ('up','page up'):
             self.frame.set_focus('body')
@@ -156,13 +163,48 @@ class InputDialogDisplay(DialogDisplay):
             return exitcode, ""
 
 
+class CompletionDialogDisplay(InputDialogDisplay):
+    """
+    Input box listing the completions of the last comma separated word,
+    tab completes it with the first one.
+    """
+    def __init__(self, text, height, width, complete):
+        self.complete = complete
+        self.matches = []
+        self.edit = urwid.Edit()
+        self.suggestions = urwid.Text("")
+        urwid.connect_signal(self.edit, "change", self.on_change)
+        body = urwid.ListBox([self.edit, self.suggestions])
+        body = urwid.AttrWrap(body, 'selectable','focustext')
+
+        DialogDisplay.__init__(self, text, height, width, body)
+
+        self.frame.set_focus('body')
+
+    def retarget(self, text, height, width, complete):
+        self.complete = complete
+        InputDialogDisplay.retarget(self, text, height, width)
+
+    def on_change(self, edit, text):
+        word = text.rpartition(",")[2].strip()
+        self.matches = self.complete(word) if word else []
+        self.suggestions.set_text("\n".join(self.matches))
+
+    def unhandled_key(self, size, k):
+        if k == 'tab' and self.matches:
+            head, sep, _ = self.edit.edit_text.rpartition(",")
+            text = head + sep + (" " if sep else "") + self.matches[0]
+            self.edit.set_edit_text(text)
+            self.edit.set_edit_pos(len(text))
+        else:
+            InputDialogDisplay.unhandled_key(self, size, k)
+
+
 class TextDialogDisplay(DialogDisplay):
     def __init__(self, file, height, width):
-        l = []
-        # read the whole file (being slow, not lazy this time)
-        for line in open(file).readlines():
-            l.append( urwid.Text( line.rstrip() ))
-        body = urwid.ListBox(l)
+        # lines are read from a memory map when displayed
+        self.walker = FileWalker(file)
+        body = urwid.ListBox(self.walker)
         body = urwid.AttrWrap(body, 'selectable','focustext')
 
         DialogDisplay.__init__(self, None, height, width, body)
@@ -174,6 +216,23 @@ class TextDialogDisplay(DialogDisplay):
             self.view.keypress( size, k )
             self.frame.set_focus('footer')
 
+    def on_exit(self, exitcode):
+        self.walker.close()
+        return exitcode, ""
+
+
+class LinesDialogDisplay(DialogDisplay):
+    def __init__(self, text, lines, height, width):
+        # scrolled with the arrows, closed with enter or escape
+        self.walker = urwid.SimpleListWalker([urwid.Text(line) for line in lines])
+        body = urwid.ListBox(self.walker)
+
+        DialogDisplay.__init__(self, text, height, width, body)
+
+    def unhandled_key(self, size, k):
+        if k in ('enter', 'esc'):
+            self.fuck(0)
+
 
 class ListDialogDisplay(DialogDisplay):
     def __init__(self, text, height, width, constr, items, has_default):
@@ -276,6 +335,11 @@ def do_inputbox(text, height, width):
     d.add_buttons([    ("OK", 0), ("Cancel", 1) ])
     return d
 
+def do_completion(text, height, width, complete):
+    d = CompletionDialogDisplay( text, height, width, complete )
+    d.add_buttons([    ("OK", 0), ("Cancel", 1) ])
+    return d
+
 def do_menu(text, height, width, menu_height, *items):
     def constr(tag, state ):
         return MenuItem(tag)
@@ -292,6 +356,12 @@ def do_msgbox(text, height, width):
     d.add_buttons([    ("OK", 0) ])
     return d
 
+def do_lines(text, lines, height, width):
+    d = LinesDialogDisplay( text, lines, height, width )
+    d.add_buttons([    ("OK", 0) ])
+    d.frame.set_focus('body')
+    return d
+
 def do_radiolist(text, height, width, list_height, *items):
     radiolist = []
     def constr(tag, state, radiolist=radiolist):
@@ -310,6 +380,93 @@ def do_yesno(text, height, width):
     d.add_buttons([    ("Yes", 0), ("No", 1) ])
     return d
 
+class DialogManager:
+    """
+    Shows the dialogs one at a time laid over view.interface, the ones
+    opened meanwhile wait in a queue. The common dialogs are built once
+    and retargeted with the text and callback of each call.
+    """
+    def __init__(self):
+        self.templates = {}
+        self.pending = deque()
+        self.current = None
+        self.overlay = None
+        self.unhandled_input = None
+
+    def template(self, kind):
+        if kind not in self.templates:
+            self.templates[kind] = TEMPLATES[kind]()
+        return self.templates[kind]
+
+    def open(self, kind, callback, *args):
+        """Show a pooled dialog of the given kind, retargeted with args"""
+        self.push(kind, args, callback)
+
+    def push(self, dialog, args, callback):
+        self.pending.append((dialog, args, callback))
+        if self.current is None:
+            self.show_next()
+
+    def show_next(self):
+        dialog, args, callback = self.pending.popleft()
+        if isinstance(dialog, str):
+            dialog = self.template(dialog)
+            dialog.retarget(*args)
+        self.current = callback
+
+        def close(button):
+            exitcode = button if type(button) is int else button.exitcode
+            self.close(*dialog.on_exit(exitcode))
+        dialog.button_press = close
+        dialog.fuck = close
+
+        if self.overlay is None:
+            self.overlay = urwid.Overlay(dialog.box, view.interface,
+                'center', dialog.width, 'middle', dialog.height)
+        else:
+            self.overlay.top_w = dialog.box
+            self.overlay.set_overlay_parameters(
+                'center', dialog.width, 'middle', dialog.height)
+        if view.main_loop.widget is not self.overlay:
+            self.unhandled_input = view.main_loop.unhandled_input
+            view.main_loop.widget = self.overlay
+        view.main_loop.unhandled_input = lambda key: dialog.unhandled_key((0,0), key)
+
+    def close(self, exitcode, exitstr):
+        callback = self.current
+        self.current = None
+        if self.pending:
+            self.show_next()
+        else:
+            view.main_loop.widget = view.interface
+            view.main_loop.unhandled_input = self.unhandled_input
+        callback(exitcode, exitstr)
+
+manager = DialogManager()
+
+TEMPLATES = {
+    "msgbox": lambda: do_msgbox("", 0, 0),
+    "yesno": lambda: do_yesno("", 0, 0),
+    "inputbox": lambda: do_inputbox("", 0, 0),
+    "completion": lambda: do_completion("", 0, 0, lambda word: []),
+}
+
+def msgbox(text, height, width, callback=lambda *args: None):
+    manager.open("msgbox", callback, text, height, width)
+
+def linesbox(text, lines, height, width, callback=lambda *args: None):
+    do_lines(text, lines, height, width).call(callback)
+
+def yesno(text, height, width, callback):
+    manager.open("yesno", callback, text, height, width)
+
+def inputbox(text, height, width, callback):
+    manager.open("inputbox", callback, text, height, width)
+
+def completion(text, height, width, complete, callback):
+    manager.open("completion", callback, text, height, width, complete)
+
+
 MODES={    '--checklist':    (do_checklist,
         "text height width list-height [ tag item status ] ..."),
     '--inputbox':    (do_inputbox,
@@ -0,0 +1,82 @@
+import asyncio
+import time
+from collections import deque
+
+import metrics
+from config import EVENT_QUEUES
+
+# Events that can be thrown away when a queue is full
+DROPPABLE = {"heartbeat", "server:notice"}
+
+def supersede_key(message):
+    """Events sharing a key only matter for the most recent one"""
+    if message["type"] in ("group:user is ready", "group:user is not ready"):
+        return ("readiness", message["user"]["userid"])
+    return None
+
+
+class EventQueue:
+    """
+    Bounded queue between a msgqueue stream and its dispatcher. When full,
+    the "block" policy makes the stream wait, "drop" first throws away
+    the oldest droppable event and "collapse" first replaces an event
+    superseded by the new one, then drops.
+    """
+    def __init__(self, scope, maxsize, policy):
+        self.scope = scope
+        self.maxsize = maxsize
+        self.policy = policy
+        self.items = deque()
+        self.readable = asyncio.Event()
+        self.writable = asyncio.Event()
+        self.dropped = 0
+        self.collapsed = 0
+        # Monotonic time the last event returned by get was queued at
+        self.queued = None
+        self.latency = metrics.histogram("event queue ms %s" % scope)
+        metrics.gauge("event queue %s" % scope, lambda: len(self.items))
+        metrics.gauge("events dropped %s" % scope, lambda: self.dropped)
+        metrics.gauge("events collapsed %s" % scope, lambda: self.collapsed)
+
+    async def put(self, message):
+        key = supersede_key(message) if self.policy == "collapse" else None
+        while len(self.items) >= self.maxsize and not self.make_room(key):
+            self.writable.clear()
+            await self.writable.wait()
+        self.items.append((time.monotonic(), message, key))
+        self.readable.set()
+
+    def make_room(self, key):
+        if key is not None:
+            for item in self.items:
+                if item[2] == key:
+                    self.items.remove(item)
+                    self.collapsed += 1
+                    return True
+        if self.policy != "block":
+            for item in self.items:
+                if item[1]["type"] in DROPPABLE:
+                    self.items.remove(item)
+                    self.dropped += 1
+                    return True
+        return False
+
+    async def get(self):
+        while not self.items:
+            self.readable.clear()
+            await self.readable.wait()
+        self.queued, message, _ = self.items.popleft()
+        self.writable.set()
+        self.latency.observe((time.monotonic() - self.queued) * 1000)
+        return message
+
+    def clear(self):
+        self.items.clear()
+        self.writable.set()
+
+
+queues = {}
+def get_queue(scope):
+    if scope not in queues:
+        queues[scope] = EventQueue(scope, *EVENT_QUEUES[scope])
+    return queues[scope]
@@ -0,0 +1,159 @@
+import asyncio
+import errno
+import json
+import random
+from collections import Counter
+from logging import getLogger
+from types import SimpleNamespace
+
+import aiohttp
+
+logger = getLogger(__name__)
+
+
+class Faults:
+    """
+    Degraded network settings, every field is optional:
+        latency:   added before each request and each stream chunk, in ms,
+                   ["fixed", ms], ["uniform", low, high],
+                   ["exponential", mean] or ["lognormal", mu, sigma]
+        bandwidth: bytes per second of response bodies and streams
+        reset:     probability of a connection reset per request/chunk
+        fragment:  streams chunks are split in pieces of at most that many bytes
+        http_5xx:  probability of answering a request with a 503
+        seed:      random seed, for reproducible runs
+    """
+    def __init__(self, latency=None, bandwidth=None, reset=0, fragment=None,
+                 http_5xx=0, seed=None):
+        self.latency_spec = latency
+        self.bandwidth = bandwidth
+        self.reset = reset
+        self.fragment = fragment
+        self.http_5xx = http_5xx
+        self.random = random.Random(seed)
+        self.stats = Counter()
+
+    def latency(self):
+        if self.latency_spec is None:
+            return 0
+        kind, *params = self.latency_spec
+        if kind == "fixed":
+            delay = params[0]
+        elif kind == "uniform":
+            delay = self.random.uniform(*params)
+        elif kind == "exponential":
+            delay = self.random.expovariate(1 / params[0])
+        elif kind == "lognormal":
+            delay = self.random.lognormvariate(*params)
+        else:
+            raise ValueError("Unknown latency distribution %s" % kind)
+        return delay / 1000
+
+    def roll(self, probability):
+        return probability and self.random.random() < probability
+
+    async def throttle(self, size):
+        if self.bandwidth:
+            await asyncio.sleep(size / self.bandwidth)
+
+
+def connection_reset(url):
+    key = SimpleNamespace(host=url.host, port=url.port, ssl=False, is_ssl=False)
+    return aiohttp.ClientConnectorError(
+        key, OSError(errno.ECONNRESET, "Injected connection reset"))
+
+
+class FaultyRequest:
+    """Async context manager wrapping the one of ClientSession.request"""
+    def __init__(self, request, url, faults):
+        self.request = request
+        self.url = url
+        self.faults = faults
+        self.entered = False
+
+    async def __aenter__(self):
+        await asyncio.sleep(self.faults.latency())
+        if self.faults.roll(self.faults.reset):
+            self.faults.stats["resets"] += 1
+            self.request.close()
+            raise connection_reset(self.url)
+        if self.faults.roll(self.faults.http_5xx):
+            self.faults.stats["5xx"] += 1
+            self.request.close()
+            return InjectedError(self.url)
+        self.entered = True
+        return FaultyResponse(await self.request.__aenter__(), self.faults)
+
+    async def __aexit__(self, *exc_info):
+        if self.entered:
+            return await self.request.__aexit__(*exc_info)
+
+
+class InjectedError:
+    status = 503
+    reason = "Service Unavailable"
+    content_type = "text/plain"
+
+    def __init__(self, url):
+        self.url = url
+        self.headers = {}
+        # A msgqueue stream ending at once, it is opened again
+        self.content = aiohttp.streams.EMPTY_PAYLOAD
+
+    async def text(self):
+        return "Injected error"
+
+
+class FaultyResponse:
+    def __init__(self, response, faults):
+        self.response = response
+        self.faults = faults
+        self.content = FaultyStream(response.content, faults)
+
+    def __getattr__(self, name):
+        return getattr(self.response, name)
+
+    async def read(self):
+        body = await self.response.read()
+        await self.faults.throttle(len(body))
+        return body
+
+    async def text(self):
+        return (await self.read()).decode(self.response.get_encoding())
+
+    async def json(self):
+        return json.loads(await self.text())
+
+
+class FaultyStream:
+    def __init__(self, stream, faults):
+        self.stream = stream
+        self.faults = faults
+        self.pending = b""
+
+    async def readany(self):
+        if not self.pending:
+            chunk = await self.stream.readany()
+            if not chunk:
+                return chunk
+            await asyncio.sleep(self.faults.latency())
+            if self.faults.roll(self.faults.reset):
+                self.faults.stats["resets"] += 1
+                raise aiohttp.ServerDisconnectedError()
+            self.pending = chunk
+        size = len(self.pending)
+        if self.faults.fragment:
+            size = self.faults.random.randint(1, min(size, self.faults.fragment))
+            self.faults.stats["fragments"] += 1
+        fragment, self.pending = self.pending[:size], self.pending[size:]
+        await self.faults.throttle(len(fragment))
+        return fragment
+
+
+active = None
+
+def configure(spec):
+    global active
+    active = Faults(**spec) if spec else None
+    if active is not None:
+        logger.warning("Injecting network faults: %s", spec)
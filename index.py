@@ -0,0 +1,74 @@
+from bisect import bisect_left, insort
+
+
+def tokenize(text):
+    return text.casefold().split()
+
+
+class PrefixIndex:
+    """
+    Sorted array of (token, item number) pairs. Every word of the text of
+    an item is a token, a query matches the items having, for each word of
+    the query, a token starting with it.
+    """
+    def __init__(self, text=str):
+        self.text = text
+        self.items = []
+        self.entries = []
+        self.known = set()
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, text):
+        return text.casefold() in self.known
+
+    def add(self, item):
+        itemno = len(self.items)
+        self.items.append(item)
+        self.known.add(self.text(item).casefold())
+        for token in set(tokenize(self.text(item))):
+            insort(self.entries, (token, itemno))
+
+    def extend(self, items):
+        for item in items:
+            itemno = len(self.items)
+            self.items.append(item)
+            self.known.add(self.text(item).casefold())
+            self.entries.extend((token, itemno) for token in set(tokenize(self.text(item))))
+        self.entries.sort()
+
+    def matching(self, prefix):
+        """Item numbers of the tokens starting with prefix, by token"""
+        entries = self.entries
+        position = bisect_left(entries, (prefix,))
+        while position < len(entries) and entries[position][0].startswith(prefix):
+            yield entries[position][1]
+            position += 1
+
+    def prefixed(self, prefix):
+        return set(self.matching(prefix))
+
+    def first(self, prefix, limit):
+        """First limit items having a token starting with prefix, by token"""
+        found = {}
+        for itemno in self.matching(prefix):
+            if len(found) >= limit:
+                break
+            found[itemno] = None
+        return [self.items[itemno] for itemno in found]
+
+    def search(self, query, limit=None):
+        tokens = tokenize(query)
+        if not tokens:
+            return self.items[:limit]
+        if len(tokens) == 1 and limit is not None:
+            # as you type completion, stop at the first matches
+            return self.first(tokens[0], limit)
+        matches = None
+        for token in sorted(tokens, key=len, reverse=True):
+            found = self.prefixed(token)
+            matches = found if matches is None else matches & found
+            if not matches:
+                return []
+        return [self.items[itemno] for itemno in sorted(matches)[:limit]]
@@ -0,0 +1,185 @@
+"""
+Matchmaking and event latencies.
+
+The server clock is estimated from the Date header of the API responses
+and the timestamps of the events: each gives bounds of the offset between
+the two clocks, the estimate is the middle of their intersection. Events
+only give a lower bound (they cannot arrive before being sent), when they
+are the only source the server to client latencies are underestimated.
+"""
+
+import asyncio
+import atexit
+import json
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+from logging import getLogger
+from math import inf
+
+import aiohttp
+
+import metrics
+
+logger = getLogger(__name__)
+
+# Event field holding the time (seconds since epoch) the server sent it at
+TIMESTAMP = "sent"
+
+# (previous step, histogram) of the matchmaking steps
+STEPS = {
+    "game starting": ("queue joined", "queue wait s"),
+    "game started": ("game starting", "game start s"),
+}
+
+HISTOGRAMS = ["event latency ms", "event to render ms"] + [
+    histogram for _, histogram in STEPS.values()]
+
+# Events handled but not drawn yet, the oldest are forgotten when nothing
+# draws the screen (headless runs)
+UNRENDERED = 256
+
+path = None
+steps = {}
+unrendered = deque(maxlen=UNRENDERED)
+event_latency = metrics.histogram("event latency ms")
+render_latency = metrics.histogram("event to render ms")
+
+
+class ClockOffset:
+    """
+    Server clock minus the local one, known to be within [low, high].
+    Samples narrow the interval, one that does not overlap it means one of
+    the clocks stepped and the estimate starts over.
+    """
+    def __init__(self):
+        self.low = -inf
+        self.high = inf
+        self.samples = 0
+        self.resets = 0
+
+    def add(self, low, high=inf):
+        if low > self.high or high < self.low:
+            logger.info("Clock offset out of [%.3f, %.3f] s, estimating it again",
+                        self.low, self.high)
+            self.low, self.high = low, high
+            self.resets += 1
+        else:
+            self.low = max(self.low, low)
+            self.high = min(self.high, high)
+        self.samples += 1
+
+    @property
+    def value(self):
+        if self.low == -inf:
+            return 0 if self.high == inf else self.high
+        if self.high == inf:
+            return self.low
+        return (self.low + self.high) / 2
+
+    @property
+    def error(self):
+        return (self.high - self.low) / 2
+
+clock = ClockOffset()
+metrics.gauge("clock offset ms", lambda: round(clock.value * 1000, 1))
+metrics.gauge("clock offset error ms", lambda: round(clock.error * 1000, 1))
+
+def server_time():
+    return time.time() + clock.value
+
+
+def trace_config():
+    """aiohttp client tracing, the Date header of every response is a sample"""
+    config = aiohttp.TraceConfig()
+
+    async def on_request_start(_session, context, params):
+        context.sent = time.time()
+
+    async def on_request_end(_session, context, params):
+        date = params.response.headers.get("Date")
+        if date is None:
+            return
+        try:
+            date = parsedate_to_datetime(date).timestamp()
+        except (TypeError, ValueError):
+            return
+        # The date is truncated to the second
+        clock.add(date - time.time(), date + 1 - context.sent)
+
+    config.on_request_start.append(on_request_start)
+    config.on_request_end.append(on_request_end)
+    return config
+
+
+def event_recieved(message):
+    """Server to client latency of a timestamped event, read from a stream"""
+    if TIMESTAMP not in message:
+        return
+    recieved = time.time()
+    clock.add(message[TIMESTAMP] - recieved)
+    event_latency.observe(max(0, recieved + clock.value - message[TIMESTAMP]) * 1000)
+
+def event_handled(queued):
+    """The event queued at the given monotonic time is shown on the next draw"""
+    unrendered.append(queued)
+
+def rendering(draw_screen):
+    def wrapped(*args, **kwargs):
+        result = draw_screen(*args, **kwargs)
+        if unrendered:
+            now = time.monotonic()
+            for queued in unrendered:
+                render_latency.observe((now - queued) * 1000)
+            unrendered.clear()
+        return result
+    return wrapped
+
+
+def step(name, payload=None):
+    """Matchmaking step reached, by the event payload when there is one"""
+    at = payload[TIMESTAMP] if payload and TIMESTAMP in payload else server_time()
+    steps[name] = at
+    if name not in STEPS:
+        return
+    previous, histogram = STEPS[name]
+    since = steps.pop(previous, None)
+    if since is None:
+        return
+    metrics.histogram(histogram).observe(at - since)
+    logger.info("%s after %.1f s", name.capitalize(), at - since)
+    write({"metric": histogram, "value": round(at - since, 3)})
+
+def reset():
+    """Matchmaking left, the next steps must not be measured from the previous ones"""
+    steps.clear()
+
+
+def summary():
+    stats = {name: metrics.histogram(name).summary() for name in HISTOGRAMS}
+    error = clock.error if clock.error != inf else None
+    return dict(stats, offset=clock.value, error=error, samples=clock.samples)
+
+def write(entry):
+    if path is None:
+        return
+    entry = dict(entry, time=time.time(), offset=round(clock.value, 4))
+    try:
+        with open(path, "a") as file:
+            file.write(json.dumps(entry) + "\n")
+    except OSError as exc:
+        logger.warning("Cannot write latency log %s: %s", path, exc)
+
+def start(filename, interval=60):
+    """Append the matchmaking waits and a summary every interval to filename"""
+    global path
+    path = filename
+    atexit.register(export)
+    asyncio.get_event_loop().call_later(interval, periodic, interval)
+
+def periodic(interval):
+    export()
+    asyncio.get_event_loop().call_later(interval, periodic, interval)
+
+def export():
+    write({"metric": "summary", "value": summary()})
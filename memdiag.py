@@ -0,0 +1,64 @@
+import asyncio
+import gc
+import tracemalloc
+from logging import getLogger
+
+import urwid
+
+import metrics
+import view
+
+logger = getLogger(__name__)
+
+TOP = 10
+FILTERS = (tracemalloc.Filter(False, tracemalloc.__file__),
+           tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+           tracemalloc.Filter(False, "<unknown>"))
+
+baseline = None
+previous = None
+widgets = 0
+
+metrics.gauge("tasks (all)", lambda: len(asyncio.all_tasks()))
+metrics.gauge("widgets group members", lambda: len(view.p_members.contents))
+metrics.gauge("widgets game picker", lambda: len(view.p_new_group.walker.widgets)
+                                            + len(view.p_new_group.walker.pool))
+
+def count_widgets():
+    return sum(1 for obj in gc.get_objects() if isinstance(obj, urwid.Widget))
+
+def take_snapshot():
+    return tracemalloc.take_snapshot().filter_traces(FILTERS)
+
+def report(snapshot, reference, top=TOP):
+    """Log the allocation sites that grew the most since reference"""
+    for stat in snapshot.compare_to(reference, "lineno")[:top]:
+        if stat.size_diff <= 0:
+            break
+        logger.info("%+.1f kB (%+d blocks) %s", stat.size_diff / 1024,
+                    stat.count_diff, stat.traceback.format()[0].strip())
+
+def check():
+    global previous, widgets
+    snapshot = take_snapshot()
+    widgets = count_widgets()
+    current, peak = tracemalloc.get_traced_memory()
+    logger.info("Memory: %.0f kB traced (peak %.0f kB), %d widgets, %d tasks",
+                current / 1024, peak / 1024, widgets, len(asyncio.all_tasks()))
+    report(snapshot, previous)
+    previous = snapshot
+
+def start(interval, frames=1):
+    global baseline, previous
+    tracemalloc.start(frames)
+    baseline = previous = take_snapshot()
+    metrics.gauge("memory traced kB", lambda: tracemalloc.get_traced_memory()[0] // 1024)
+    metrics.gauge("widgets", lambda: widgets)
+    asyncio.get_event_loop().call_later(interval, periodic, interval)
+
+def periodic(interval):
+    check()
+    asyncio.get_event_loop().call_later(interval, periodic, interval)
+
+def report_since_start(top=TOP):
+    report(take_snapshot(), baseline, top)
@@ -0,0 +1,61 @@
+from bisect import bisect_left
+
+BOUNDS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000)
+FINE_BOUNDS = (0.01, 0.02, 0.05, 0.1, 0.2, 0.5) + BOUNDS
+
+class Histogram:
+    def __init__(self, name, bounds=BOUNDS):
+        self.name = name
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0
+        self.min = 0
+        self.max = 0
+
+    def observe(self, value):
+        self.buckets[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value) if self.count > 1 else value
+        self.max = max(self.max, value)
+
+    def percentile(self, pct):
+        """Interpolated in its bucket, within the observed values"""
+        if not self.count:
+            return 0
+        rank = self.count * pct / 100
+        seen = 0
+        lower = self.min
+        for bound, hits in zip(self.bounds + (self.max,), self.buckets):
+            if hits and seen + hits >= rank:
+                low, high = max(lower, self.min), min(bound, self.max)
+                return low + (high - low) * (rank - seen) / hits
+            seen += hits
+            lower = bound
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "max": self.max}
+
+
+histograms = {}
+gauges = {}
+
+def histogram(name, bounds=BOUNDS):
+    if name not in histograms:
+        histograms[name] = Histogram(name, bounds)
+    return histograms[name]
+
+def gauge(name, func):
+    gauges[name] = func
+
+def snapshot():
+    stats = {name: func() for name, func in gauges.items()}
+    stats.update({name: hist.summary() for name, hist in histograms.items()})
+    return stats
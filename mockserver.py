@@ -0,0 +1,261 @@
+#!venv/bin/python
+"""
+Local stand-in for the webgames API, good enough to run the client and
+the benchmarks against. State is kept in memory, any password is valid.
+"""
+
+import argparse
+import asyncio
+import json
+import time
+import uuid
+from base64 import urlsafe_b64encode
+from collections import defaultdict
+
+from aiohttp import web
+from aiohttp.test_utils import make_mocked_request
+
+import compression
+
+HEARTBEAT = 30
+
+
+def make_token(userid, nick):
+    def b64(obj):
+        return urlsafe_b64encode(json.dumps(obj).encode()).rstrip(b"=").decode()
+    return "%s.%s.mock" % (b64({"alg": "none", "typ": "JWT"}), b64({
+        "uid": userid, "typ": "player", "nic": nick, "exp": int(time.time()) + 3600}))
+
+def error(status, message):
+    return web.json_response({"error": message}, status=status)
+
+
+class BatchedCall:
+    """Request of a call in a batch, as much of it as the handlers use"""
+    def __init__(self, request, match_info, body):
+        self.headers = request.headers
+        self.match_info = match_info
+        self.body = body
+
+    async def json(self):
+        return self.body
+
+
+class MockServer:
+    def __init__(self, games=100, batching=True):
+        self.batching = batching
+        self.games = [{"gameid": gameid, "name": "Game %d" % gameid, "capacity": 4}
+                      for gameid in range(1, games + 1)]
+        self.tokens = {}
+        self.users = {}
+        self.groups = {}
+        self.streams = defaultdict(set)
+
+        self.app = web.Application()
+        self.app.router.add_post("/v1/auth", self.auth)
+        self.app.router.add_delete("/v1/auth/", self.logout)
+        self.app.router.add_get("/v1/games", self.game_list)
+        self.app.router.add_get("/v1/games/byid/{gameid}", self.game_by_id)
+        self.app.router.add_post("/v1/groups/create/{gameid}", self.create_group)
+        self.app.router.add_get("/v1/groups/", self.my_group)
+        self.app.router.add_post("/v1/groups/invite/byname/{name}", self.invite)
+        self.app.router.add_post("/v1/groups/join/{groupid}", self.join)
+        self.app.router.add_post("/v1/groups/ready", self.ready)
+        self.app.router.add_delete("/v1/groups/ready", self.not_ready)
+        self.app.router.add_delete("/v1/groups/leave", self.leave)
+        self.app.router.add_post("/v1/groups/start", self.start)
+        self.app.router.add_get("/v1/msgqueues/{scope}", self.msgqueue)
+        self.app.router.add_post("/v1/batch", self.batch)
+
+    def user(self, request):
+        token = request.headers.get("Authorization", "").rpartition(" ")[2]
+        if token not in self.tokens:
+            raise web.HTTPUnauthorized(
+                text=json.dumps({"error": "Invalid token"}), content_type="application/json")
+        return self.users[self.tokens[token]]
+
+    def publish(self, userid, scope, message):
+        message.setdefault("sent", time.time())
+        frame = json.dumps(message).encode() + b"\x1e"
+        for queue in self.streams[(userid, scope)]:
+            queue.put_nowait(frame)
+
+    def publish_group(self, group, message):
+        for member in group["members"]:
+            self.publish(member["id"], "group", message)
+
+    def member_event(self, group, user, event):
+        self.publish_group(group, {"type": "group:%s" % event, "user": {
+            "userid": user["userid"], "username": user["name"]}})
+
+    async def auth(self, request):
+        body = await request.json()
+        userid = str(uuid.uuid5(uuid.NAMESPACE_OID, body["login"]))
+        self.users.setdefault(userid, {"userid": userid, "name": body["login"], "group": None})
+        token = make_token(userid, body["login"])
+        self.tokens[token] = userid
+        return web.json_response({"token": token})
+
+    async def logout(self, request):
+        self.user(request)
+        del self.tokens[request.headers["Authorization"].rpartition(" ")[2]]
+        return web.Response(status=204)
+
+    async def game_list(self, request):
+        return web.json_response(self.games)
+
+    async def game_by_id(self, request):
+        gameid = int(request.match_info["gameid"])
+        if not 1 <= gameid <= len(self.games):
+            return error(404, "Game not found")
+        return web.json_response(self.games[gameid - 1])
+
+    async def create_group(self, request):
+        user = self.user(request)
+        groupid = str(uuid.uuid4())
+        self.groups[groupid] = {
+            "groupid": groupid, "gameid": int(request.match_info["gameid"]),
+            "state": "GROUP_CHECK", "slotid": None, "partyid": None,
+            "members": [{"id": user["userid"], "name": user["name"], "ready": False}]}
+        user["group"] = groupid
+        return web.json_response({"groupid": groupid})
+
+    async def my_group(self, request):
+        user = self.user(request)
+        if user["group"] is None:
+            return error(404, "Not in a group")
+        return web.json_response(self.groups[user["group"]])
+
+    async def invite(self, request):
+        user = self.user(request)
+        if user["group"] is None:
+            return error(400, "Not in a group")
+        name = request.match_info["name"]
+        invitee = next((other for other in self.users.values() if other["name"] == name), None)
+        if invitee is None:
+            return error(404, "Player not found")
+        group = self.groups[user["group"]]
+        self.publish(invitee["userid"], "user", {
+            "type": "group:invitation recieved",
+            "from": {"userid": user["userid"], "username": user["name"]},
+            "to": {"groupid": group["groupid"],
+                   "gamename": self.games[group["gameid"] - 1]["name"]}})
+        return web.Response(status=204)
+
+    async def join(self, request):
+        user = self.user(request)
+        group = self.groups.get(request.match_info["groupid"])
+        if group is None:
+            return error(404, "Group not found")
+        group["members"].append({"id": user["userid"], "name": user["name"], "ready": False})
+        user["group"] = group["groupid"]
+        self.member_event(group, user, "user joined")
+        return web.Response(status=204)
+
+    def set_ready(self, request, ready):
+        user = self.user(request)
+        if user["group"] is None:
+            return error(400, "Not in a group")
+        group = self.groups[user["group"]]
+        next(member for member in group["members"] if member["id"] == user["userid"])["ready"] = ready
+        self.member_event(group, user, "user is ready" if ready else "user is not ready")
+        return web.Response(status=204)
+
+    async def ready(self, request):
+        return self.set_ready(request, True)
+
+    async def not_ready(self, request):
+        return self.set_ready(request, False)
+
+    async def leave(self, request):
+        user = self.user(request)
+        if user["group"] is None:
+            return error(400, "Not in a group")
+        group = self.groups[user["group"]]
+        self.member_event(group, user, "user left")
+        group["members"] = [member for member in group["members"] if member["id"] != user["userid"]]
+        user["group"] = None
+        return web.Response(status=204)
+
+    async def start(self, request):
+        user = self.user(request)
+        group = self.groups[user["group"]]
+        group["state"] = "IN_QUEUE"
+        self.publish_group(group, {"type": "group:queue joined"})
+        return web.Response(status=204)
+
+    async def msgqueue(self, request):
+        user = self.user(request)
+        key = (user["userid"], request.match_info["scope"])
+        queue = asyncio.Queue()
+        self.streams[key].add(queue)
+        response = web.StreamResponse()
+        encoding = compression.negotiate(request.headers.get(compression.HEADER))
+        compressor = None
+        if encoding is not None:
+            response.headers[compression.HEADER] = encoding
+            compressor = compression.compressor(encoding)
+        response.enable_chunked_encoding()
+        await response.prepare(request)
+        try:
+            while True:
+                try:
+                    frame = await asyncio.wait_for(queue.get(), HEARTBEAT)
+                except asyncio.TimeoutError:
+                    frame = b'{"type": "heartbeat"}\x1e'
+                if compressor is not None:
+                    frame = compression.encode(compressor, frame)
+                await response.write(frame)
+        finally:
+            self.streams[key].discard(queue)
+
+    async def batch(self, request):
+        """Run the calls in order, as if they were made one after the other"""
+        if not self.batching:
+            return error(404, "Not found")
+        results = []
+        for call in await request.json():
+            match_info = await self.app.router.resolve(make_mocked_request(
+                call["method"], call["url"], headers=request.headers, app=self.app))
+            try:
+                response = await match_info.handler(
+                    BatchedCall(request, match_info, call.get("body")))
+            except web.HTTPException as exc:
+                response = exc
+            body = None
+            if response.content_type == "application/json":
+                body = json.loads(response.text)
+            results.append({"status": response.status, "reason": response.reason, "body": body})
+        return web.json_response(results)
+
+    def storm(self, groupid, count):
+        """Toggle the readiness of the members of a group count times"""
+        group = self.groups[groupid]
+        for eventno in range(count):
+            member = group["members"][eventno % len(group["members"])]
+            member["ready"] = not member["ready"]
+            self.publish_group(group, {
+                "type": "group:user is ready" if member["ready"] else "group:user is not ready",
+                "user": {"userid": member["id"], "username": member["name"]},
+                "sent": time.time()})
+
+    async def serve(self, host="localhost", port=0):
+        """Start serving in the running loop, return the base url"""
+        runner = web.AppRunner(self.app)
+        await runner.setup()
+        site = web.TCPSite(runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        return "http://%s:%d" % (host, port)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, default=22548)
+    parser.add_argument("--games", type=int, default=100)
+    args = parser.parse_args()
+    web.run_app(MockServer(args.games).app, host="localhost", port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,47 +2,92 @@ import aiohttp
 import aiohttp.client_exceptions
 import asyncio
 import atexit
+import contextvars
 import json
+import time
 from collections import defaultdict
 from logging import getLogger, INFO
 from functools import partial
 from operator import itemgetter, iand
-from urllib.parse import urljoin
+from urllib.parse import urljoin, urlsplit
 from contextlib import suppress
 
 import tenacity
+import yarl
 
+import compression
 import controller
-from config import APIURL
+import events
+import faults
+import latency
+import metrics
+import recorder
+import supervisor
+import tracing
+from config import APIURL, PLAYER_DIRECTORY, STREAM_ENCODINGS
+from index import PrefixIndex
+from remote import remote, remotable
 from tools import async_tryexcept, APIError, find
 import view
 
 logger = getLogger(__name__)
-http = aiohttp.ClientSession(loop=controller.loop)
+http = aiohttp.ClientSession(loop=controller.loop, trace_configs=[tracing.trace_config(), latency.trace_config()])
 
 class Container:
     pass
 container = Container()
 container.token = None
+container.credentials = None
 container.user = Container()
 container.group = Container()
 container.slot = Container()
 container.party = Container()
+container.game = None
 container.games = None
 
+# Known player names, for the invite autocompletion
+players = PrefixIndex()
+def remember_players(names):
+    players.extend({name for name in names
+                    if name and name not in players and name != getattr(container.user, "nick", None)})
+
+# Batch collecting the requests of the calls made by batch()
+batching = contextvars.ContextVar("batching", default=None)
+
+def unbatched(_exc):
+    # Batched calls are retried together by send_batch, in order
+    return batching.get() is None
+
 retry = partial(tenacity.retry,
-                retry=tenacity.retry_if_exception_type(aiohttp.client_exceptions.ClientConnectorError),
+                retry=tenacity.retry_if_exception_type(aiohttp.client_exceptions.ClientConnectorError)
+                      & tenacity.retry_if_exception(unbatched),
                 wait=tenacity.wait_fixed(3) + tenacity.wait_random_exponential(max=7),
                 stop=tenacity.stop_after_attempt(10),
                 before=tenacity.before_log(logger, INFO),
                 reraise=True)
 
+# Streams are only read, they can be reopened after any transport error
+stream_retry = partial(retry, retry=tenacity.retry_if_exception_type((
+    aiohttp.client_exceptions.ClientConnectorError,
+    aiohttp.client_exceptions.ServerDisconnectedError,
+    aiohttp.client_exceptions.ClientPayloadError,
+    asyncio.TimeoutError)))
+
 def req(method, url, headers=None, *args, **kwargs):
+    current = batching.get()
+    if current is not None and headers is None and not args and set(kwargs) <= {"json"}:
+        return BatchedRequest(current, method, url, kwargs.get("json"))
+    return request(method, url, headers, *args, **kwargs)
+
+def request(method, url, headers=None, *args, **kwargs):
     if headers is None:
         headers = {}
     if container.token is not None:
         headers["Authorization"] = "Bearer: %s" % container.token
-    return http.request(method, urljoin(APIURL, url), headers=headers, *args, **kwargs)
+    request = http.request(method, urljoin(APIURL, url), headers=headers, *args, **kwargs)
+    if faults.active is not None:
+        return faults.FaultyRequest(request, yarl.URL(urljoin(APIURL, url)), faults.active)
+    return request
 
 async def handle_error(res):
     if res.content_type == "application/json":
@@ -57,6 +102,120 @@ async def handle_error(res):
             res.url, res.status, await res.text())
         raise APIError(res.status, res.reason)
 
+batch_supported = True
+batch_sizes = metrics.histogram("batch size")
+
+class Batch:
+    """
+    Requests made within one iteration of the loop, sent together to
+    v1/batch where the server runs them in order. They are sent one after
+    the other instead when the server has no such endpoint.
+    """
+    def __init__(self):
+        self.calls = []
+
+    def add(self, method, url, body):
+        future = asyncio.get_event_loop().create_future()
+        self.calls.append((method.upper(), urljoin(APIURL, url), body, future))
+        if len(self.calls) == 1:
+            asyncio.get_event_loop().call_soon(self.flush)
+        return future
+
+    def flush(self):
+        calls, self.calls = self.calls, []
+        asyncio.ensure_future(send_batch(calls))
+
+class BatchedRequest:
+    def __init__(self, batch, method, url, body):
+        self.batch = batch
+        self.method = method
+        self.url = url
+        self.body = body
+
+    async def __aenter__(self):
+        return await self.batch.add(self.method, self.url, self.body)
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+class BatchedResponse:
+    """Result of a batched call, as much of a response as the API functions use"""
+    def __init__(self, url, status, reason, body):
+        self.url = url
+        self.status = status
+        self.reason = reason
+        self.body = body
+        self.content_type = "text/plain" if body is None else "application/json"
+
+    async def json(self):
+        return self.body
+
+    async def text(self):
+        return json.dumps(self.body)
+
+@retry()
+async def post_batch(calls):
+    """Responses of the calls, None when the server could not batch them"""
+    global batch_supported
+    payload = [{"method": method, "url": urlsplit(url).path, "body": body}
+               for method, url, body, _ in calls]
+    async with request("post", "v1/batch", json=payload) as res:
+        if res.status == 200:
+            return [BatchedResponse(url, result["status"], result.get("reason", ""),
+                                    result.get("body"))
+                    for (_, url, _, _), result in zip(calls, await res.json())]
+        if res.status in (401, 403):
+            await handle_error(res)
+        if res.status in (404, 405, 501):
+            logger.info("The server cannot batch requests, sending them one by one")
+            batch_supported = False
+        else:
+            logger.warning("Batch failed with status %d, sending the requests one by one",
+                           res.status)
+        return None
+
+@retry()
+async def send_one(method, url, body):
+    async with request(method, url, json=body) as res:
+        response_body = None
+        if res.content_type == "application/json":
+            response_body = await res.json()
+        return BatchedResponse(url, res.status, res.reason, response_body)
+
+async def send_batch(calls):
+    # This task inherited the context of the batch, its retries are its own
+    batching.set(None)
+    batch_sizes.observe(len(calls))
+    try:
+        responses = None
+        if batch_supported and len(calls) > 1:
+            responses = await post_batch(calls)
+        if responses is not None:
+            for (_, _, _, future), response in zip(calls, responses):
+                future.set_result(response)
+            return
+
+        # In order, the calls of a batch may depend on the previous ones
+        for method, url, body, future in calls:
+            future.set_result(await send_one(method, url, body))
+    except Exception as exc:
+        for _, _, _, future in calls:
+            if not future.done():
+                future.set_exception(exc)
+
+async def batch(*coros):
+    """
+    Run the API calls in a single request, in order, return their results.
+    Through the session daemon they are simply made one after the other.
+    """
+    if remote.connected:
+        return [await coro for coro in coros]
+    token = batching.set(Batch())
+    try:
+        return await asyncio.gather(*coros)
+    finally:
+        batching.reset(token)
+
 event_handlers = {
     "user": defaultdict(dict),
     "group": defaultdict(dict),
@@ -68,12 +227,27 @@ def event_handler(scope, categ, command):
         return func
     return register
 
-async def reader(res):
+stream_bytes = {"wire": 0, "decoded": 0}
+metrics.gauge("stream kB on wire", lambda: stream_bytes["wire"] // 1024)
+metrics.gauge("stream kB decoded", lambda: stream_bytes["decoded"] // 1024)
+
+def open_stream(scope):
+    headers = {}
+    if STREAM_ENCODINGS:
+        headers[compression.HEADER] = compression.accept(STREAM_ENCODINGS)
+    return req("get", "v1/msgqueues/%s" % scope, headers=headers, timeout=None)
+
+async def reader(res, scope):
+    decoder = compression.decompressor(res.headers.get(compression.HEADER))
     buffer = b""
     while True:
         chunk = await asyncio.wait_for(res.content.readany(), 65)
         if not chunk:
             break
+        stream_bytes["wire"] += len(chunk)
+        if decoder is not None:
+            chunk = decoder.decompress(chunk)
+        stream_bytes["decoded"] += len(chunk)
         buffer += chunk
         raw_messages = buffer.split(bytes([30]))
         if len(raw_messages) == 1:
@@ -81,37 +255,97 @@ async def reader(res):
 
         buffer = raw_messages[-1]
         for raw_message in raw_messages[:-1]:
+            if recorder.recording is not None:
+                recorder.record(scope, raw_message)
             yield json.loads(raw_message)
 
 
-@retry()
+@stream_retry()
 @async_tryexcept
 async def msgqueue(scope):
     with suppress(asyncio.CancelledError):
-        async with req("get", "v1/msgqueues/%s" % scope, timeout=None) as res:
-            logger.info("Getting messages from scope %s", scope)
-            async for message in reader(res):
+        queue = start_dispatch(scope)
+        if remote.connected:
+            await remote_msgqueue(scope, queue)
+            return
+        async with open_stream(scope) as res:
+            logger.info("Getting messages from scope %s (encoding: %s)",
+                        scope, res.headers.get(compression.HEADER, "none"))
+            async for message in reader(res, scope):
                 if message["type"] == "heartbeat":
                     continue
+                latency.event_recieved(message)
+                if handler(scope, message) is None:
+                    continue
+                await queue.put(message)
+            logger.info("End of stream for scope %s", scope)
+            raise tenacity.TryAgain()
 
-                categ, cmd = message["type"].split(":")
+async def remote_msgqueue(scope, queue):
+    # The daemon socket also carries the call answers, its reader only
+    # hands the events over and this task waits on the full queue
+    inbox = asyncio.Queue()
+    remote.subscribe(scope, inbox.put_nowait)
+    remote.closed.add_done_callback(lambda _: inbox.put_nowait(None))
+    logger.info("Getting messages from scope %s through the session daemon", scope)
+    try:
+        while True:
+            message = await inbox.get()
+            if message is None:
+                break
+            latency.event_recieved(message)
+            if handler(scope, message) is None:
+                continue
+            await queue.put(message)
+    finally:
+        remote.unsubscribe(scope)
+    logger.error("Lost the session daemon, messages from scope %s are no more recieved", scope)
 
-                callback = event_handlers[scope].get(categ, {}).get(cmd)
-                if callback is None:
-                    logger.warning("Cannot handle event type \"%s\" for queue %s",
-                                   message["type"], scope)
-                    continue
-                logger.debug("Event %s recieved !", message["type"])
-                view.footer.set_text("Event %s recieved !" % message["type"])
-                del message["type"]
+def handler(scope, message):
+    """Handler of the event, None with a warning when there is none"""
+    try:
+        categ, cmd = message["type"].split(":")
+        return event_handlers[scope][categ][cmd]
+    except (KeyError, TypeError, AttributeError, ValueError):
+        logger.warning("Cannot handle event type \"%s\" for queue %s",
+                       message.get("type") if isinstance(message, dict) else message,
+                       scope)
+        return None
+
+def start_dispatch(scope):
+    queue = events.get_queue(scope)
+    if supervisor.scopes[scope].get("dispatch") is None:
+        supervisor.scopes[scope].spawn(dispatch(scope, queue), "dispatch")
+    return queue
 
+async def dispatch(scope, queue):
+    try:
+        while True:
+            message = await queue.get()
+            started = time.perf_counter()
+            callback = handler(scope, message)
+            if callback is None:
+                continue
+            event_type = message.pop("type")
+            logger.debug("Event %s recieved !", event_type)
+            view.footer.set_text("Event %s recieved !" % event_type)
+
+            with tracing.span("event %s" % event_type, root=True):
                 if asyncio.iscoroutinefunction(callback):
-                    asyncio.ensure_future(callback(message))
+                    supervisor.handlers[scope].spawn(callback(message))
                 else:
-                    callback(message)
-            logger.info("End of stream for scope %s", scope)
-            raise tenacity.TryAgain()
+                    try:
+                        callback(message)
+                    except Exception as exc:
+                        logger.exception("%s, see logs for details.", str(exc))
+            latency.event_handled(queue.queued)
+            metrics.histogram("handler ms %s" % event_type, metrics.FINE_BOUNDS).observe(
+                (time.perf_counter() - started) * 1000)
+    finally:
+        # Pending events are meaningless once the scope is left
+        queue.clear()
 
+@remotable
 @retry()
 async def register(username, email, password):
     payload = {"username": username, "email": email, "password": password}
@@ -122,6 +356,7 @@ async def register(username, email, password):
         json_body = await res.json()
         return json_body["userid"]
 
+@remotable
 @retry()
 async def connect(login, password):
     payload = {"login": login, "password": password}
@@ -132,21 +367,44 @@ async def connect(login, password):
         json_body = await res.json()
         return json_body["token"]
 
+@remotable
 @retry()
 async def disconnect():
     async with req("delete", "v1/auth/") as res:
         if res.status != 204:
             await handle_error(res)
 
+@remotable
 @retry()
+async def fetch_game_list():
+    async with req("get", "/v1/games") as res:
+        if res.status != 200:
+            await handle_error(res)
+        return await res.json()
+
+games_request = None
+def prefetch_game_list():
+    global games_request
+    if container.games is not None:
+        return None
+    if (games_request is None
+            or games_request.cancelled()
+            or games_request.done() and games_request.exception() is not None):
+        games_request = asyncio.ensure_future(fetch_game_list())
+        games_request.add_done_callback(log_prefetch_failure)
+    return games_request
+
+def log_prefetch_failure(future):
+    if not future.cancelled() and future.exception() is not None:
+        logger.debug("Game list prefetch failed: %s", future.exception())
+
 async def get_game_list():
-    if container.games is None:
-        async with req("get", "/v1/games") as res:
-            if res.status != 200:
-                await handle_error(res)        
-            container.games = await res.json()
+    request = prefetch_game_list()
+    if request is not None:
+        container.games = await asyncio.shield(request)
     return container.games
 
+@remotable
 @retry()
 async def create_group(gameid):
     async with req("post", "v1/groups/create/%d" % gameid) as res:
@@ -155,6 +413,7 @@ async def create_group(gameid):
         json_body = await res.json()
         return json_body["groupid"]
 
+@remotable
 @retry()
 async def get_my_group():
     async with req("get", "v1/groups/") as res:
@@ -165,8 +424,12 @@ async def get_my_group():
         json_body = await res.json()
         return json_body
 
+@remotable
 @retry()
 async def get_game_by_id(gameid):
+    if container.games is None and games_request is not None and not games_request.done():
+        with suppress(Exception):
+            await get_game_list()
     if container.games:
         game = find(lambda game: game["gameid"] == gameid, container.games)
         if game:
@@ -178,38 +441,52 @@ async def get_game_by_id(gameid):
         json_body = await res.json()
         return json_body
 
+@remotable
 @retry()
 async def invite(name):
     async with req("post", "v1/groups/invite/byname/%s" % name) as res:
         if res.status != 204:
             await handle_error(res)
 
+@remotable
 @retry()
 async def join_group(groupid):
     async with req("post", "v1/groups/join/%s" % groupid) as res:
         if res.status != 204:
             await handle_error(res)
 
+@remotable
 @retry()
 async def mark_as_ready():
     async with req("post", "v1/groups/ready") as res:
         if res.status != 204:
             await handle_error(res)
 
+@remotable
 @retry()
 async def mark_as_not_ready():
     async with req("delete", "v1/groups/ready") as res:
         if res.status != 204:
             await handle_error(res)
 
+@remotable
 @retry()
 async def leave_group():
     async with req("delete", "v1/groups/leave") as res:
         if res.status != 204:
             await handle_error(res)
 
+@remotable
 @retry()
 async def start():
     async with req("post", "v1/groups/start") as res:
         if res.status != 204:
             await handle_error(res)
+
+@remotable
+@retry()
+async def get_player_directory():
+    async with req("get", PLAYER_DIRECTORY) as res:
+        if res.status != 200:
+            await handle_error(res)
+        return await res.json()
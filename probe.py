@@ -0,0 +1,77 @@
+import asyncio
+import json
+import time
+from logging import getLogger
+
+from config import PROBE_BUDGET, PROBE_UDP, PROBE_LOG
+
+logger = getLogger(__name__)
+
+
+async def tcp_rtt(host, port):
+    started = time.perf_counter()
+    _reader, writer = await asyncio.open_connection(host, port)
+    rtt = time.perf_counter() - started
+    writer.close()
+    return rtt
+
+
+class EchoProtocol(asyncio.DatagramProtocol):
+    def __init__(self, future):
+        self.future = future
+
+    def datagram_received(self, data, addr):
+        if not self.future.done():
+            self.future.set_result(time.perf_counter())
+
+    def error_received(self, exc):
+        if not self.future.done():
+            self.future.set_exception(exc)
+
+
+async def udp_rtt(host, port, payload=b"ping"):
+    loop = asyncio.get_event_loop()
+    future = loop.create_future()
+    transport, _protocol = await loop.create_datagram_endpoint(
+        lambda: EchoProtocol(future), remote_addr=(host, port))
+    try:
+        started = time.perf_counter()
+        transport.sendto(payload)
+        return await future - started
+    finally:
+        transport.close()
+
+async def measure(rtt, host, port, budget):
+    try:
+        return round(await asyncio.wait_for(rtt(host, port), budget) * 1000, 2), None
+    except asyncio.TimeoutError:
+        return None, "timeout"
+    except OSError as exc:
+        return None, exc.strerror or str(exc)
+
+async def probe_port(host, port, budget, udp):
+    result = {"port": port}
+    result["tcp ms"], result["tcp error"] = await measure(tcp_rtt, host, port, budget)
+    if udp:
+        result["udp ms"], result["udp error"] = await measure(udp_rtt, host, port, budget)
+    return result
+
+async def probe(host, ports, budget=PROBE_BUDGET, udp=PROBE_UDP):
+    """Probe every port at once within budget seconds, return the best one and the results"""
+    results = await asyncio.gather(*(probe_port(host, port, budget, udp) for port in ports))
+    reachable = [result for result in results if result["tcp ms"] is not None]
+    best = min(reachable, key=lambda result: result["tcp ms"])["port"] if reachable else ports[0]
+    return best, results
+
+def record(host, best, results, **extra):
+    logger.info("Probed %s, best port %d: %s", host, best, ", ".join(
+        "%d %s" % (result["port"], "%.1f ms" % result["tcp ms"] if result["tcp ms"] is not None
+                   else result["tcp error"]) for result in results))
+    if PROBE_LOG is None:
+        return
+    entry = dict(extra, time=time.time(), host=host, best=best, results=results)
+    try:
+        with open(PROBE_LOG, "a") as file:
+            file.write(json.dumps(entry) + "\n")
+    except OSError as exc:
+        logger.warning("Cannot write probe log %s: %s", PROBE_LOG, exc)
@@ -0,0 +1,139 @@
+import asyncio
+import atexit
+import cProfile
+import os
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+SAMPLE_INTERVAL = 0.005
+
+
+class TimedCoroutine:
+    """Coroutine proxy adding the time spent in each step to its stats"""
+    def __init__(self, coro, stats):
+        self.coro = coro
+        self.stats = stats[getattr(coro, "__qualname__", type(coro).__name__)]
+        self.created = time.perf_counter()
+        self.__name__ = getattr(coro, "__name__", "coroutine")
+        self.__qualname__ = getattr(coro, "__qualname__", self.__name__)
+
+    def step(self, method, *args):
+        started = time.thread_time()
+        try:
+            return method(*args)
+        except BaseException:
+            self.stats[1] += 1
+            self.stats[3] += time.perf_counter() - self.created
+            raise
+        finally:
+            self.stats[0] += 1
+            self.stats[2] += time.thread_time() - started
+
+    def send(self, value):
+        return self.step(self.coro.send, value)
+
+    def throw(self, *args):
+        return self.step(self.coro.throw, *args)
+
+    def close(self):
+        return self.coro.close()
+
+    def __await__(self):
+        return self
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self.send(None)
+
+    def __getattr__(self, name):
+        # cr_frame, cr_code... for asyncio debug mode
+        return getattr(self.coro, name)
+
+
+class Sampler(threading.Thread):
+    """Collapsed stacks of a thread, sampled every interval"""
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append("%s (%s:%d)" % (
+                    code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+
+class Profiler:
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.loop = asyncio.get_event_loop()
+        self.profile = cProfile.Profile()
+        self.sampler = Sampler(threading.get_ident())
+        # steps, done, cpu seconds, wall seconds of finished ones
+        self.coroutines = defaultdict(lambda: [0, 0, 0.0, 0.0])
+
+    def task_factory(self, loop, coro):
+        return asyncio.Task(TimedCoroutine(coro, self.coroutines), loop=loop)
+
+    def start(self):
+        self.loop.set_task_factory(self.task_factory)
+        self.sampler.start()
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+        self.sampler.stopped.set()
+        self.sampler.join()
+        self.loop.set_task_factory(None)
+
+        self.profile.dump_stats(self.prefix + ".pstats")
+        with open(self.prefix + ".collapsed", "w") as file:
+            for stack, hits in self.sampler.stacks.most_common():
+                file.write("%s %d\n" % (stack, hits))
+        with open(self.prefix + ".coroutines", "w") as file:
+            file.write("%-60s %8s %8s %12s %12s\n" % ("coroutine", "steps", "done", "cpu s", "wall s"))
+            for name, (steps, done, cpu, wall) in sorted(
+                    self.coroutines.items(), key=lambda item: item[1][2], reverse=True):
+                file.write("%-60s %8d %8d %12.4f %12.4f\n" % (name, steps, done, cpu, wall))
+        logger.info("Profile written to %s.{pstats,collapsed,coroutines}", self.prefix)
+
+
+profiler = None
+runs = 0
+
+def start(prefix):
+    global profiler
+    profiler = Profiler(prefix)
+    profiler.start()
+    atexit.register(stop)
+
+def stop():
+    global profiler
+    if profiler is not None:
+        profiler.stop()
+        profiler = None
+
+def toggle(prefix="profile"):
+    global runs
+    if profiler is None:
+        runs += 1
+        start("%s-%d" % (prefix, runs))
+        logger.info("Profiling...")
+    else:
+        stop()
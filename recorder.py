@@ -0,0 +1,36 @@
+import atexit
+import struct
+import time
+
+# Snapshots are groups given to controller.update_group, they let a
+# replay start from the same state than the recorded session.
+SCOPES = ["user", "group", "party", "server", "snapshot"]
+HEADER = struct.Struct("!dBI")
+
+recording = None
+
+def start(path):
+    global recording
+    recording = open(path, "ab")
+    atexit.register(stop)
+
+def stop():
+    if recording is not None:
+        recording.close()
+
+def record(scope, frame):
+    recording.write(HEADER.pack(time.time(), SCOPES.index(scope), len(frame)))
+    recording.write(frame)
+
+def read(path):
+    """Yield the (timestamp, scope, frame) records of a recording"""
+    with open(path, "rb") as file:
+        while True:
+            header = file.read(HEADER.size)
+            if len(header) < HEADER.size:
+                return
+            timestamp, scope, length = HEADER.unpack(header)
+            frame = file.read(length)
+            if len(frame) < length:
+                return
+            yield timestamp, SCOPES[scope], frame
@@ -0,0 +1,107 @@
+import asyncio
+import json
+from functools import wraps
+from itertools import count
+from logging import getLogger
+
+from config import DAEMON_SOCKET
+from tools import APIError
+
+logger = getLogger(__name__)
+
+path = DAEMON_SOCKET.format("") if DAEMON_SOCKET else None
+
+def setup(instance):
+    global path
+    if DAEMON_SOCKET:
+        path = DAEMON_SOCKET.format(instance)
+
+
+class Remote:
+    """
+    Connection to the session daemon, see daemon.py. Packets are json
+    lines: calls are answered by id, events of the subscribed scopes are
+    pushed as they arrive.
+    """
+    def __init__(self):
+        self.reader = None
+        self.writer = None
+        self.calls = {}
+        self.call_ids = count()
+        self.subscriptions = {}
+        self.closed = None
+
+    @property
+    def connected(self):
+        return self.writer is not None
+
+    async def attach(self, path):
+        try:
+            self.reader, self.writer = await asyncio.open_unix_connection(path)
+        except OSError:
+            return False
+        self.closed = asyncio.get_event_loop().create_future()
+        asyncio.ensure_future(self.listen())
+        logger.info("Attached to session daemon %s", path)
+        return True
+
+    def detach(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    async def listen(self):
+        try:
+            while True:
+                line = await self.reader.readline()
+                if not line:
+                    break
+                packet = json.loads(line)
+                if "event" in packet:
+                    callback = self.subscriptions.get(packet["event"])
+                    if callback is not None:
+                        callback(packet["message"])
+                    continue
+                future = self.calls.pop(packet["id"], None)
+                if future is None or future.done():
+                    continue
+                if "error" in packet:
+                    future.set_exception(APIError(*packet["error"]))
+                else:
+                    future.set_result(packet["result"])
+        finally:
+            self.writer = None
+            for future in self.calls.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("Session daemon connection lost"))
+            self.calls.clear()
+            self.closed.set_result(None)
+
+    def send(self, packet):
+        self.writer.write(json.dumps(packet).encode() + b"\n")
+
+    async def call(self, name, *args):
+        callid = next(self.call_ids)
+        future = self.calls[callid] = asyncio.get_event_loop().create_future()
+        self.send({"id": callid, "call": name, "args": args})
+        return await future
+
+    def subscribe(self, scope, callback):
+        self.subscriptions[scope] = callback
+        self.send({"subscribe": scope})
+
+    def unsubscribe(self, scope):
+        self.subscriptions.pop(scope, None)
+        if self.connected:
+            self.send({"unsubscribe": scope})
+
+remote = Remote()
+
+def remotable(func):
+    """Run the API call in the session daemon when attached to one"""
+    @wraps(func)
+    async def wrapped(*args):
+        if remote.connected:
+            return await remote.call(func.__name__, *args)
+        return await func(*args)
+    return wrapped
@@ -0,0 +1,120 @@
+#!venv/bin/python
+"""
+Feed a msgqueue recording (see --record) back through the event queues,
+the handlers and the widget rendering, then report what each event cost.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import time
+
+import urwid
+
+import controller
+import dialog
+import events
+import metrics
+import model
+import probe
+import recorder
+import supervisor
+import view
+
+logger = logging.getLogger(__name__)
+
+
+def offline():
+    """
+    Answer the API calls, port probes and game launches of the handlers
+    locally, a replay only measures the dispatch and the rendering.
+    """
+    async def no_call(*args):
+        return None
+
+    async def my_group():
+        # the recorded snapshots then give the group the server answered
+        return dict(vars(model.container.group))
+
+    async def no_probe(host, ports, *args):
+        return ports[0], {}
+
+    # The API functions are the decorated coroutine functions
+    for name, func in list(vars(model).items()):
+        if asyncio.iscoroutinefunction(func) and hasattr(func, "__wrapped__"):
+            setattr(model, name, no_call)
+    model.get_my_group = my_group
+    probe.probe = no_probe
+    probe.record = lambda *args, **kwargs: None
+    controller.Popen = lambda args: None
+
+async def drain():
+    while any(queue.items for queue in events.queues.values()):
+        await asyncio.sleep(0)
+
+async def replay(path, speed, size):
+    render = metrics.histogram("replay render ms", metrics.FINE_BOUNDS)
+    count = 0
+    previous = None
+    started = time.perf_counter()
+    for timestamp, scope, frame in recorder.read(path):
+        if speed and previous is not None:
+            await asyncio.sleep((timestamp - previous) / speed)
+        previous = timestamp
+
+        if scope == "snapshot":
+            controller.update_group(json.loads(frame.decode()))
+            continue
+        message = json.loads(frame.decode())
+        if message["type"] == "heartbeat":
+            continue
+        categ, cmd = message["type"].split(":")
+        if cmd not in model.event_handlers[scope].get(categ, {}):
+            continue
+
+        await model.start_dispatch(scope).put(message)
+        await drain()
+        before = time.perf_counter()
+        view.main_loop.widget.render(size, focus=True)
+        render.observe((time.perf_counter() - before) * 1000)
+        count += 1
+
+    elapsed = time.perf_counter() - started
+    supervisor.user.cancel()
+    return count, elapsed
+
+def report(count, elapsed):
+    print("%d events replayed in %.3f s (%.0f events/s)" % (
+        count, elapsed, count / elapsed if elapsed else 0))
+    print("%-40s %8s %10s %10s %10s" % ("", "count", "mean ms", "p95 ms", "max ms"))
+    for name, hist in sorted(metrics.histograms.items()):
+        if name.startswith(("handler ms", "replay render ms", "event queue ms")):
+            stats = hist.summary()
+            print("%-40s %8d %10.3f %10.3f %10.3f" % (
+                name, stats["count"], stats["mean"], stats["p95"], stats["max"]))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("recording")
+    parser.add_argument("--speed", type=float, default=0,
+                        help="1 replays at the recorded pace, 0 (default) as fast as possible")
+    parser.add_argument("--size", type=int, nargs=2, default=(120, 40),
+                        metavar=("COLS", "ROWS"), help="rendered screen size")
+    args = parser.parse_args()
+
+    logging.root.handlers = [logging.NullHandler()]
+    # Not run, dialogs only need to swap its widget
+    view.main_loop = urwid.MainLoop(
+        view.interface,
+        palette=dialog.DialogDisplay.palette,
+        event_loop=urwid.AsyncioEventLoop(loop=controller.loop))
+    controller.register_events()
+    offline()
+    count, elapsed = controller.loop.run_until_complete(
+        replay(args.recording, args.speed, tuple(args.size)))
+    report(count, elapsed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+import asyncio
+import time
+from functools import wraps
+from logging import getLogger
+
+import metrics
+import tracing
+from config import ACTION_TIMEOUT
+
+logger = getLogger(__name__)
+
+
+class Resource:
+    def __init__(self, name):
+        self.name = name
+        self.lock = asyncio.Lock()
+        self.waiting = 0
+        self.latest = {}
+        self.superseded = set()
+        self.wait_time = metrics.histogram("action wait ms %s" % name)
+        metrics.gauge("action queue %s" % name, lambda: self.waiting)
+
+resources = {}
+def get_resource(name):
+    if name not in resources:
+        resources[name] = Resource(name)
+    return resources[name]
+
+
+def action(resource, latest_wins=False, timeout=ACTION_TIMEOUT):
+    """
+    Serialize the decorated coroutine with every other action of the same
+    resource. Actions on distinct resources run concurrently. When
+    latest_wins is set, a new call cancels the previous, queued or running,
+    call of the same action instead of waiting for it.
+    """
+    def decorator(func):
+        name = func.__name__
+
+        @wraps(func)
+        async def wrapped(*args, **kwargs):
+            res = get_resource(resource)
+            task = asyncio.current_task()
+            if latest_wins:
+                previous = res.latest.get(name)
+                if previous is not None and not previous.done():
+                    res.superseded.add(previous)
+                    previous.cancel()
+                res.latest[name] = task
+
+            if res.lock.locked():
+                logger.debug("Action %s queued behind %d others on %s.",
+                             name, res.waiting + 1, resource)
+            queued = time.monotonic()
+            res.waiting += 1
+            try:
+                with tracing.span("wait %s" % resource):
+                    await res.lock.acquire()
+            except asyncio.CancelledError:
+                if task in res.superseded:
+                    res.superseded.discard(task)
+                    logger.debug("Action %s superseded.", name)
+                    return None
+                raise
+            finally:
+                res.waiting -= 1
+            res.wait_time.observe((time.monotonic() - queued) * 1000)
+
+            try:
+                return await asyncio.wait_for(func(*args, **kwargs), timeout)
+            except asyncio.CancelledError:
+                if task in res.superseded:
+                    res.superseded.discard(task)
+                    logger.debug("Action %s superseded.", name)
+                    return None
+                raise
+            except asyncio.TimeoutError:
+                logger.error("Action %s timed out after %g seconds.", name, timeout)
+                return None
+            finally:
+                res.lock.release()
+                if res.latest.get(name) is task:
+                    del res.latest[name]
+        return tracing.traced("action %s" % name)(wrapped)
+    return decorator
+
+
+def stats():
+    return {name: {"waiting": res.waiting,
+                   "running": int(res.lock.locked())}
+            for name, res in resources.items()}
@@ -0,0 +1,128 @@
+#!venv/bin/python
+"""
+Soak test, replay group events for hours through the event queues, the
+handlers and the rendering, and fail if traced memory keeps growing.
+"""
+
+import argparse
+import itertools
+import json
+import logging
+import sys
+import time
+import tracemalloc
+
+import urwid
+
+import controller
+import dialog
+import memdiag
+import model
+import recorder
+import view
+from replay import drain
+
+logger = logging.getLogger(__name__)
+
+
+class HeadlessScreen(urwid.BaseScreen):
+    """Screen of the given size, canvases are rendered but not displayed"""
+    def __init__(self, size):
+        super().__init__()
+        self.size = size
+
+    def get_cols_rows(self):
+        return self.size
+
+    def draw_screen(self, size, canvas):
+        pass
+
+    def hook_event_loop(self, event_loop, callback):
+        pass
+
+    def unhook_event_loop(self, event_loop):
+        pass
+
+def synthetic_events(players=8):
+    """Endless group events, each player joins, gets ready, not ready and leaves"""
+    for round_ in itertools.count():
+        for userid in range(players):
+            user = {"userid": "soak-%d" % userid, "username": "player%d-%d" % (userid, round_ % 100)}
+            yield "group", {"type": "group:user joined", "user": user}
+            yield "group", {"type": "group:user is ready", "user": user}
+            yield "group", {"type": "server:notice", "notice": "round %d" % round_}
+            yield "group", {"type": "group:user is not ready", "user": user}
+            yield "group", {"type": "group:user left", "user": user}
+
+def recorded_events(path):
+    """Endless loop over the events of a recording"""
+    while True:
+        for _timestamp, scope, frame in recorder.read(path):
+            if scope == "snapshot":
+                continue
+            message = json.loads(frame.decode())
+            if message["type"] != "heartbeat":
+                yield scope, message
+
+async def soak(source, duration, check_every, warmup, limit):
+    started = time.monotonic()
+    last_check = started
+    reference = None
+    count = 0
+    for scope, message in source:
+        await model.start_dispatch(scope).put(dict(message))
+        count += 1
+        if count % 100 == 0:
+            await drain()
+            view.main_loop.draw_screen()
+
+        now = time.monotonic()
+        if now - last_check < check_every:
+            continue
+        last_check = now
+        current = tracemalloc.get_traced_memory()[0]
+        print("%6.0f s, %d events, %.0f kB traced" % (now - started, count, current / 1024))
+        if reference is None and now - started >= warmup:
+            reference = current
+            memdiag.previous = memdiag.take_snapshot()
+        elif reference is not None and current - reference > limit:
+            print("Memory grew by %.0f kB, more than the %.0f kB allowed" % (
+                (current - reference) / 1024, limit / 1024))
+            logging.root.handlers = [logging.StreamHandler(sys.stdout)]
+            memdiag.report(memdiag.take_snapshot(), memdiag.previous)
+            return False
+        if now - started >= duration:
+            return True
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--recording", help="loop over a recording instead of synthetic events")
+    parser.add_argument("--hours", type=float, default=1)
+    parser.add_argument("--check-every", type=float, default=60, metavar="SECONDS")
+    parser.add_argument("--warmup", type=float, default=120, metavar="SECONDS")
+    parser.add_argument("--limit-kb", type=float, default=2048,
+                        help="allowed growth after the warmup")
+    args = parser.parse_args()
+
+    logging.root.handlers = [logging.NullHandler()]
+    view.main_loop = urwid.MainLoop(
+        view.interface,
+        palette=dialog.DialogDisplay.palette,
+        screen=HeadlessScreen((120, 40)),
+        event_loop=urwid.AsyncioEventLoop(loop=controller.loop))
+    controller.hook_draw_screen()
+    # The player is always a member of their group
+    controller.update_group({"state": "GROUP_CHECK", "groupid": "soak", "gameid": 1,
+                             "slotid": None, "partyid": None,
+                             "members": [{"id": "soak", "name": "soak", "ready": False}]})
+    tracemalloc.start()
+
+    source = recorded_events(args.recording) if args.recording else synthetic_events()
+    bounded = controller.loop.run_until_complete(soak(
+        source, args.hours * 3600, args.check_every, args.warmup,
+        args.limit_kb * 1024))
+    sys.exit(0 if bounded else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+import asyncio
+from collections import deque
+from logging import getLogger
+
+import metrics
+from config import HANDLER_LIMITS
+
+logger = getLogger(__name__)
+groups = {}
+
+
+class TaskGroup:
+    """
+    A named set of tasks. At most `limit` tasks run at once, the others
+    wait in FIFO order so a limit of 1 keeps them ordered. Cancelling a
+    group cancels its children groups as well.
+    """
+    def __init__(self, name, limit=None, parent=None):
+        self.name = name
+        self.limit = limit
+        self.tasks = {}
+        self.cancelling = set()
+        self.pending = deque()
+        self.children = []
+        self.started = 0
+        self.failed = 0
+        if parent is not None:
+            parent.children.append(self)
+        groups[name] = self
+        metrics.gauge("tasks %s" % name, lambda: len(self.tasks))
+
+    def spawn(self, coro, name=None):
+        if name is not None:
+            previous = self.get(name)
+            if previous is not None:
+                self.stop(previous)
+        if self.limit is not None and len(self.tasks) >= self.limit:
+            self.pending.append((coro, name))
+            return None
+        return self.start(coro, name)
+
+    def start(self, coro, name):
+        task = asyncio.ensure_future(coro)
+        self.tasks[task] = name or coro.__qualname__
+        self.started += 1
+        task.add_done_callback(self.done)
+        return task
+
+    def done(self, task):
+        name = self.tasks.pop(task)
+        self.cancelling.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            self.failed += 1
+            logger.error("Task %s of %s failed: %s", name, self.name,
+                         task.exception(), exc_info=task.exception())
+        while self.pending and len(self.tasks) < self.limit:
+            self.start(*self.pending.popleft())
+
+    def get(self, name):
+        for task, task_name in self.tasks.items():
+            if task_name == name and not task.done() and task not in self.cancelling:
+                return task
+        return None
+
+    def cancel(self):
+        for child in self.children:
+            child.cancel()
+        for coro, _ in self.pending:
+            coro.close()
+        self.pending.clear()
+        for task in list(self.tasks):
+            self.stop(task)
+
+    def stop(self, task):
+        self.cancelling.add(task)
+        task.cancel()
+
+    def stats(self):
+        return {"running": len(self.tasks),
+                "pending": len(self.pending),
+                "started": self.started,
+                "failed": self.failed}
+
+
+# Leaving the group stops the party, logging out stops everything
+user = TaskGroup("user")
+group = TaskGroup("group", parent=user)
+party = TaskGroup("party", parent=group)
+scopes = {"user": user, "group": group, "party": party}
+handlers = {scope: TaskGroup("%s handlers" % scope, HANDLER_LIMITS[scope], scopes[scope])
+            for scope in scopes}
+
+def stats():
+    return {name: group.stats() for name, group in groups.items()}
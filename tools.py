@@ -1,4 +1,6 @@
 import asyncio
+import json
+from base64 import urlsafe_b64decode
 from contextlib import suppress
 from functools import wraps
 from logging import getLogger, Handler
@@ -53,3 +55,8 @@ def find(key, iterable):
         if key(item):
             return item
     return None
+
+
+def decode_token(token):
+    b64payload = token.split(".")[1]
+    return json.loads(urlsafe_b64decode(b64payload + "=" * (-len(b64payload) % 4)).decode())
@@ -0,0 +1,128 @@
+import asyncio
+import atexit
+import contextvars
+import json
+import os
+import time
+from collections import deque
+from functools import wraps
+from itertools import count
+from logging import getLogger
+
+import aiohttp
+
+logger = getLogger(__name__)
+
+enabled = False
+trace_events = deque(maxlen=500000)
+current = contextvars.ContextVar("span", default=None)
+trace_ids = count(1)
+pid = os.getpid()
+
+
+class Span:
+    """
+    Chrome trace async span. Spans of the same interaction share the id
+    of its root span and are nested by time, the context variable makes
+    tasks created inside a span inherit it.
+    """
+    __slots__ = ("name", "trace", "args", "token")
+
+    def __init__(self, name, trace, args):
+        self.name = name
+        self.trace = trace
+        self.args = args
+        self.token = None
+
+    def __enter__(self):
+        self.token = current.set(self)
+        emit("b", self)
+        return self
+
+    def __exit__(self, *exc_info):
+        if exc_info[0] is not None:
+            self.args["error"] = repr(exc_info[1])
+        current.reset(self.token)
+        emit("e", self)
+
+
+class NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+nospan = NoSpan()
+
+
+def span(name, root=False, **args):
+    if not enabled:
+        return nospan
+    parent = None if root else current.get()
+    return Span(name, next(trace_ids) if parent is None else parent.trace, args)
+
+def emit(phase, span):
+    event = {"name": span.name, "cat": "client", "ph": phase, "id": span.trace,
+             "ts": time.perf_counter() * 1000000, "pid": pid, "tid": pid}
+    if span.args:
+        event["args"] = dict(span.args)
+    trace_events.append(event)
+
+def traced(name=None, root=False):
+    def decorator(func):
+        span_name = name or func.__qualname__
+        if asyncio.iscoroutinefunction(func):
+            @wraps(func)
+            async def wrapped(*args, **kwargs):
+                if not enabled:
+                    return await func(*args, **kwargs)
+                with span(span_name, root):
+                    return await func(*args, **kwargs)
+        else:
+            @wraps(func)
+            def wrapped(*args, **kwargs):
+                if not enabled:
+                    return func(*args, **kwargs)
+                with span(span_name, root):
+                    return func(*args, **kwargs)
+        return wrapped
+    return decorator
+
+async def root(name, coro):
+    if not enabled:
+        return await coro
+    with span(name, root=True):
+        return await coro
+
+
+def trace_config():
+    """aiohttp client tracing, a span from the request to its response headers"""
+    config = aiohttp.TraceConfig()
+
+    async def on_request_start(_session, context, params):
+        context.span = span("%s %s" % (params.method, params.url.path))
+        context.span.__enter__()
+
+    async def on_request_end(_session, context, params):
+        if context.span is not nospan:
+            context.span.args["status"] = params.response.status
+        context.span.__exit__(None, None, None)
+
+    async def on_request_exception(_session, context, params):
+        context.span.__exit__(type(params.exception), params.exception, None)
+
+    config.on_request_start.append(on_request_start)
+    config.on_request_end.append(on_request_end)
+    config.on_request_exception.append(on_request_exception)
+    return config
+
+
+def start(path):
+    global enabled
+    enabled = True
+    atexit.register(export, path)
+
+def export(path):
+    with open(path, "w") as file:
+        json.dump({"traceEvents": list(trace_events), "displayTimeUnit": "ms"}, file)
+    logger.info("Trace written to %s", path)
@@ -1,5 +1,6 @@
 import urwid
 from functools import partial
+from widgets import GamePicker
 
 SubmitButton = partial(urwid.Button, "Submit")
 
@@ -9,12 +10,14 @@ b_quit = urwid.Button("Quit")
 b_new_group = urwid.Button("New group")
 b_group = urwid.Button("Group")
 b_party = urwid.Button("Party")
+b_logs = urwid.Button("Logs")
+b_logout = urwid.Button("Logout")
 
 # Navigation bars
-n_not_connected = urwid.Columns([b_home, b_quit])
-n_connected = urwid.Columns([b_home, b_new_group, b_quit])
-n_in_group = urwid.Columns([b_home, b_group, b_quit])
-n_in_party = urwid.Columns([b_home, b_group, b_party, b_quit])
+n_not_connected = urwid.Columns([b_home, b_logs, b_quit])
+n_connected = urwid.Columns([b_home, b_new_group, b_logs, b_logout, b_quit])
+n_in_group = urwid.Columns([b_home, b_group, b_logs, b_logout, b_quit])
+n_in_party = urwid.Columns([b_home, b_group, b_party, b_logs, b_logout, b_quit])
 
 # Text fields
 t_connected_as = urwid.Text("Connected as: ")
@@ -47,7 +50,7 @@ f_login = urwid.Pile([
 ])
 
 # New group form, populated in controller
-f_new_group = urwid.SimpleFocusListWalker([])
+p_new_group = GamePicker(height=10)
 
 # Group members
 p_members = urwid.Pile([])
@@ -69,7 +72,7 @@ s_connected_home = urwid.LineBox(urwid.Pile([
     t_user_type
 ]), "Profile")
 
-s_new_group = urwid.LineBox(urwid.BoxAdapter(urwid.ListBox(f_new_group), 10), "Select a game")
+s_new_group = urwid.LineBox(p_new_group, "Select a game")
 
 s_in_group = urwid.Pile([
     urwid.LineBox(p_members, "Group"),
@@ -96,6 +99,9 @@ s_in_queue = urwid.Pile([
         b_leave
     ])
 ])
+# Log browser, created in controller once the log file is known
+s_logs = None
+
 s_playing = urwid.Pile([
     urwid.LineBox(p_members, "Group"),
     urwid.Divider(),
@@ -104,9 +110,20 @@ s_playing = urwid.Pile([
     urwid.Divider()
 ])
 
+# Screens by name, as saved in the session cache
+screens = {
+    "not connected home": s_not_connected_home,
+    "connected home": s_connected_home,
+    "new group": s_new_group,
+    "in group": s_in_group,
+    "in queue": s_in_queue,
+    "playing": s_playing}
+
 # Page structure
+t_stale = urwid.Text("", align="center")
 header = urwid.Pile([
     urwid.Text("Webgames Terminal User Interface", align="center"),
+    t_stale,
     urwid.Divider()])
 body = urwid.Pile([n_not_connected, s_not_connected_home])
 footer = urwid.Text("", wrap="clip")
@@ -0,0 +1,307 @@
+import mmap
+import os
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+from itertools import accumulate
+from operator import itemgetter
+
+import urwid
+
+from index import PrefixIndex
+
+INDEX_CHUNK = 1 << 18
+WIDGET_CACHE = 256
+
+
+class LazyWalker(urwid.ListWalker):
+    """ListWalker creating the widget of a position only when asked for"""
+    focus = 0
+
+    def get_widget(self, position):
+        raise NotImplementedError()
+
+    def get_focus(self):
+        widget = self.get_widget(self.focus)
+        return (widget, self.focus) if widget is not None else (None, None)
+
+    def set_focus(self, position):
+        self.focus = position
+        self._modified()
+
+    def get_next(self, position):
+        widget = self.get_widget(position + 1)
+        return (widget, position + 1) if widget is not None else (None, None)
+
+    def get_prev(self, position):
+        widget = self.get_widget(position - 1) if position > 0 else None
+        return (widget, position - 1) if widget is not None else (None, None)
+
+
+class FileWalker(LazyWalker):
+    """
+    Lazy, read-only walker over the lines of a file. The file is memory
+    mapped and positions are the offsets lines start at, so the lines
+    around the focus are found without reading the rest of the file. Line
+    numbers come from an index of the line offsets built chunk by chunk,
+    a Text widget only exists for recently shown lines.
+    """
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.map = None
+        self.size = 0
+        self.focus = 0
+        self.follow = False
+        self.remap()
+
+    def remap(self):
+        size = os.fstat(self.file.fileno()).st_size
+        if size == self.size and self.map is not None:
+            return False
+        if size < self.size or self.map is None:
+            # new or truncated file
+            self.offsets = array("q", [0])
+            self.indexed = False
+            self.widgets = OrderedDict()
+            self.focus = 0
+        else:
+            # the last line may be longer or terminated now
+            self.widgets.pop(self.tail(), None)
+            self.indexed = False
+        if self.map is not None:
+            self.map.close()
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        self.size = size
+        return True
+
+    def refresh(self):
+        if not self.remap():
+            return
+        if self.follow:
+            self.focus = self.tail()
+        self._modified()
+
+    def tail(self):
+        """Position of the last line"""
+        if self.map is None:
+            return 0
+        end = self.size - 1 if self.map[-1] == ord("\n") else self.size
+        return self.map.rfind(b"\n", 0, end) + 1
+
+    def index_chunk(self):
+        """Index the line offsets of the next chunk, return False once done"""
+        if self.indexed or self.map is None:
+            self.indexed = True
+            return False
+        start = self.offsets[-1]
+        end = min(start + INDEX_CHUNK, self.size)
+        last = self.map.rfind(b"\n", start, end)
+        if last == -1:
+            last = self.map.find(b"\n", end)
+            if last == -1:
+                self.indexed = True
+                return False
+        lines = self.map[start:last].split(b"\n")
+        self.offsets.extend(start + n for n in accumulate(len(line) + 1 for line in lines))
+        return True
+
+    @property
+    def lines(self):
+        """Number of lines, None until the file is indexed"""
+        if not self.indexed:
+            return None
+        return len(self.offsets) - 1 + (self.offsets[-1] < self.size)
+
+    @property
+    def progress(self):
+        """Part of the file indexed"""
+        return self.offsets[-1] / self.size if self.size else 1
+
+    def lineno(self, position):
+        """Line number of a position, None when not indexed yet"""
+        if position > self.offsets[-1]:
+            return None
+        return bisect_right(self.offsets, position) - 1
+
+    def line(self, position):
+        if self.map is None or not 0 <= position < self.size:
+            return None
+        end = self.map.find(b"\n", position)
+        end = self.size if end == -1 else end
+        return self.map[position:end].decode(errors="replace").rstrip("\r")
+
+    def get_widget(self, position):
+        widget = self.widgets.get(position)
+        if widget is not None:
+            self.widgets.move_to_end(position)
+            return widget
+        text = self.line(position)
+        if text is None:
+            return None
+        widget = self.widgets[position] = urwid.Text(text, wrap="clip")
+        if len(self.widgets) > WIDGET_CACHE:
+            self.widgets.popitem(last=False)
+        return widget
+
+    def get_next(self, position):
+        end = self.map.find(b"\n", position) if self.map is not None else -1
+        if end == -1 or end + 1 >= self.size:
+            return None, None
+        return self.get_widget(end + 1), end + 1
+
+    def get_prev(self, position):
+        if self.map is None or position <= 0:
+            return None, None
+        start = self.map.rfind(b"\n", 0, position - 1) + 1
+        return self.get_widget(start), start
+
+    def search(self, text, start=None):
+        """Position of the next line containing text after start"""
+        if self.map is None or not text:
+            return None
+        start = self.focus if start is None else start
+        end = self.map.find(b"\n", start)
+        if end == -1:
+            return None
+        pos = self.map.find(text.encode(), end + 1)
+        if pos == -1:
+            return None
+        return self.map.rfind(b"\n", 0, pos) + 1
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+        self.file.close()
+
+
+class LogBrowser(urwid.WidgetWrap):
+    """
+    Live view of a log file. Enter in the search field jumps to the next
+    match, "end" follows the tail of the file, moving up stops following.
+    Line numbers show up once poll has indexed the file.
+    """
+    def __init__(self, path, height=20):
+        self.walker = FileWalker(path)
+        self.listbox = urwid.ListBox(self.walker)
+        self.search = urwid.Edit("Search: ")
+        self.status = urwid.Text("", align="right")
+        super().__init__(urwid.Pile([
+            urwid.Columns([self.search, ("fixed", 30, self.status)]),
+            urwid.BoxAdapter(self.listbox, height)]))
+        self.set_follow(True)
+
+    def set_follow(self, follow):
+        self.walker.follow = follow
+        self.walker.refresh()
+        if follow:
+            self.walker.set_focus(self.walker.tail())
+        self.update_status()
+
+    def update_status(self, text=None):
+        lines = self.walker.lines
+        self.status.set_text(text or "%s%s" % (
+            "following, " if self.walker.follow else "",
+            "%d lines" % lines if lines is not None
+            else "indexing %d%%" % (self.walker.progress * 100)))
+
+    def poll(self):
+        """Pick up the new lines and index a chunk, True while not indexed"""
+        self.walker.refresh()
+        indexing = self.walker.index_chunk()
+        self.update_status()
+        return indexing
+
+    def keypress(self, size, key):
+        if key == "enter" and self._w.focus_position == 0:
+            position = self.walker.search(self.search.edit_text)
+            if position is None:
+                self.update_status("not found")
+            else:
+                self.walker.follow = False
+                self.walker.set_focus(position)
+                self.listbox.set_focus_valign("middle")
+                lineno = self.walker.lineno(position)
+                self.update_status("line %d" % (lineno + 1) if lineno is not None
+                                   else "found at %d%%" % (position * 100 / self.walker.size))
+            return None
+        if key == "end":
+            self.set_follow(True)
+            return None
+        if key in ("up", "page up", "home"):
+            self.walker.follow = False
+            self.update_status()
+        return super().keypress(size, key)
+
+
+class VirtualWalker(LazyWalker):
+    """
+    Walker over a list of items where widgets are only built for the
+    positions being displayed. Widgets scrolled away are kept in a pool
+    and updated with a new item when another position needs one.
+    """
+    def __init__(self, make_widget, update_widget, cache=64):
+        self.make_widget = make_widget
+        self.update_widget = update_widget
+        self.cache = cache
+        self.items = []
+        self.widgets = OrderedDict()
+        self.pool = []
+
+    def set_items(self, items):
+        self.items = items
+        self.focus = 0
+        self.pool.extend(self.widgets.values())
+        self.widgets.clear()
+        self._modified()
+
+    def get_widget(self, position):
+        if not 0 <= position < len(self.items):
+            return None
+        widget = self.widgets.get(position)
+        if widget is not None:
+            self.widgets.move_to_end(position)
+            return widget
+        widget = self.pool.pop() if self.pool else self.make_widget()
+        self.update_widget(widget, self.items[position])
+        self.widgets[position] = widget
+        if len(self.widgets) > self.cache:
+            self.pool.append(self.widgets.popitem(last=False)[1])
+        return widget
+
+
+class GamePicker(urwid.WidgetWrap):
+    """Filterable game list, emits "select" with the chosen game"""
+    signals = ["select"]
+
+    def __init__(self, height=10):
+        self.catalog = None
+        self.index = PrefixIndex(itemgetter("name"))
+        self.walker = VirtualWalker(self.make_button, self.update_button)
+        self.filter = urwid.Edit("Filter: ")
+        urwid.connect_signal(self.filter, "change", self.on_filter_change)
+        super().__init__(urwid.Pile([
+            self.filter,
+            urwid.BoxAdapter(urwid.ListBox(self.walker), height)]))
+
+    def set_catalog(self, games):
+        if games is self.catalog:
+            return
+        self.catalog = games
+        self.index = PrefixIndex(itemgetter("name"))
+        self.index.extend(games)
+        self.walker.set_items(self.index.search(self.filter.edit_text))
+
+    def on_filter_change(self, _edit, text):
+        self.walker.set_items(self.index.search(text))
+
+    def make_button(self):
+        button = urwid.Button("")
+        urwid.connect_signal(button, "click", self.on_click)
+        return urwid.AttrMap(button, None, focus_map="reversed")
+
+    def update_button(self, widget, game):
+        widget.original_widget.set_label(game["name"])
+        widget.original_widget.game = game
+
+    def on_click(self, button):
+        self._emit("select", button.game)